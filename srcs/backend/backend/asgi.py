@@ -6,15 +6,18 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 django.setup()
 
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from backend.media import MediaFilesHandler
+from usermanage.middleware import JWTAuthMiddleware
 import core.routing as routingCore
 import chat.routing as routingChat
+import usermanage.routing as routingUsermanage
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": MediaFilesHandler(get_asgi_application()),
+    "websocket": JWTAuthMiddleware(
         URLRouter(
             routingCore.websocket_urlpatterns + routingChat.websocket_urlpatterns
+            + routingUsermanage.websocket_urlpatterns
         )
     ),
 })
\ No newline at end of file
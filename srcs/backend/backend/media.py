@@ -0,0 +1,120 @@
+import mimetypes
+import re
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+# Names derived from a content hash (see usermanage.avatars) never change.
+HASHED_NAME = re.compile(r'[0-9a-f]{32}(_\d+)?\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class MediaFilesHandler:
+    """
+    ASGI app that serves MEDIA_URL straight from MEDIA_ROOT without going
+    through Django, with ETag/Last-Modified revalidation, single byte ranges
+    and immutable caching for content-hashed names. Filesystem calls run in
+    worker threads so a slow disk doesn't stall the event loop. Everything
+    else goes to the wrapped application.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, application):
+        self.application = application
+        self.base_url = settings.MEDIA_URL
+        self.root = Path(settings.MEDIA_ROOT).resolve()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith(self.base_url):
+            return await self.application(scope, receive, send)
+        await self.serve(scope, send)
+
+    async def serve(self, scope, send):
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self.respond(send, 405, [(b'allow', b'GET, HEAD')])
+
+        found = await sync_to_async(self.find, thread_sensitive=False)(scope['path'][len(self.base_url):])
+        if found is None:
+            return await self.respond(send, 404)
+
+        path, stat = found
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        request_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+        if HASHED_NAME.search(path.name):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'
+        headers = [
+            (b'etag', etag.encode()),
+            (b'last-modified', http_date(stat.st_mtime).encode()),
+            (b'cache-control', cache_control.encode()),
+            (b'accept-ranges', b'bytes'),
+        ]
+
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+                return await self.respond(send, 304, headers)
+        else:
+            if_modified_since = parse_http_date_safe(request_headers.get('if-modified-since', ''))
+            if if_modified_since is not None and int(stat.st_mtime) <= if_modified_since:
+                return await self.respond(send, 304, headers)
+
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        headers.append((b'content-type', content_type.encode()))
+
+        status, start, end = 200, 0, size - 1
+        range_header = request_headers.get('range')
+        if range_header and request_headers.get('if-range', etag) == etag:
+            match = RANGE.match(range_header.strip())
+            if match and match.group(1):
+                first = int(match.group(1))
+                last = int(match.group(2)) if match.group(2) else None
+                # last < first is an invalid range: ignored, the whole file is sent
+                if last is None or last >= first:
+                    start, end = first, size - 1 if last is None else min(last, size - 1)
+                    status = 206
+            elif match and match.group(2):
+                start, end = max(size - int(match.group(2)), 0), size - 1
+                status = 206
+            if status == 206 and (start > end or start >= size):
+                return await self.respond(send, 416, headers + [(b'content-range', f'bytes */{size}'.encode())])
+            if status == 206:
+                headers.append((b'content-range', f'bytes {start}-{end}/{size}'.encode()))
+
+        length = max(end - start + 1, 0)
+        headers.append((b'content-length', str(length).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if scope['method'] == 'HEAD' or length == 0:
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        f = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+        try:
+            read = sync_to_async(f.read, thread_sensitive=False)
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = await read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        finally:
+            f.close()
+        if remaining > 0:
+            await send({'type': 'http.response.body', 'body': b''})
+
+    def find(self, relative):
+        """(path, stat) of a file under MEDIA_ROOT, or None."""
+        path = (self.root / relative).resolve()
+        if not path.is_relative_to(self.root) or not path.is_file():
+            return None
+        return path, path.stat()
+
+    async def respond(self, send, status, headers=()):
+        await send({'type': 'http.response.start', 'status': status, 'headers': list(headers)})
+        await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,34 @@
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from redis.commands.core import AsyncScript, Script
+
+_pool = None
+
+def get_redis():
+    """Shared synchronous Redis client for HTTP views and background threads."""
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    return redis.Redis(connection_pool=_pool)
+
+_async_client = None
+
+def get_async_redis():
+    """Shared asyncio Redis client for consumers, instead of one connection per socket."""
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    return _async_client
+
+def async_script(source):
+    """
+    A Lua script hashed once, for module-level constants. Run it with
+    `await script(keys=[...], args=[...], client=get_async_redis())`; it is
+    sent by EVALSHA and loaded on the first NOSCRIPT miss.
+    """
+    return AsyncScript(None, source.encode())
+
+def script(source):
+    """The synchronous counterpart of async_script(), run with `client=get_redis()`."""
+    return Script(None, source.encode())
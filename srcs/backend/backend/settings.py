@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'django_extensions',
 	'rest_framework',
@@ -77,21 +78,140 @@ SIMPLE_JWT = {
     'SIGNING_KEY': SECRET_KEY,
 }
 
+# 42 intra OAuth. Point FT_API_URL at `manage.py run_oauth_stub` to log in
+# without the real API.
+FT_OAUTH = {
+    'API_URL': os.environ.get('FT_API_URL', 'https://api.intra.42.fr'),
+    'CLIENT_ID': os.environ.get('FT_CLIENT_ID', 'u-s4t2ud-aeae34338eb2b61bbead013fba955aaefb9923825c0ad7e439f156a270a0ba29'),
+    'CLIENT_SECRET': os.environ.get('FT_CLIENT_SECRET', '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'),
+    'REDIRECT_URI': os.environ.get('FT_REDIRECT_URI', 'https://localhost:8000/oauth/callback/'),
+    'TIMEOUT': 10,
+    'CONNECT_TIMEOUT': 3,
+    'MAX_CONNECTIONS': 20,
+    'RETRIES': 3,
+    'BACKOFF': 0.25,
+    'MAX_RETRY_AFTER': 5,
+}
+
+# Websocket handshakes authenticate with ?token=<access token>; decoded
+# tokens are cached per process so reconnects skip verifying the JWT, and
+# each user's (username, is_active) in the shared cache so they skip the database.
+WS_TOKEN_CACHE_SIZE = int(os.environ.get('WS_TOKEN_CACHE_SIZE', 10000))
+WS_TOKEN_CACHE_TTL = int(os.environ.get('WS_TOKEN_CACHE_TTL', 300))
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis", 6379)],
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
         },
     },
     "redis": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis", 6379)],
+            "hosts": [(REDIS_HOST, REDIS_PORT)],
+        },
+    },
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/1",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "IGNORE_EXCEPTIONS": True,
         },
     },
 }
 
+# Per-user friend id sets and pair checks (usermanage.friends), invalidated
+# whenever a friendship is added or removed.
+FRIENDS_CACHE_TIMEOUT = 60 * 60
+# Avatar/username "cards" shared by every user-rendering serializer.
+USER_CARD_CACHE_TIMEOUT = 24 * 60 * 60
+# users/autocomplete/ ranks recent chat partners, cached this long per user.
+AUTOCOMPLETE_RECENT_PEERS_TIMEOUT = 60
+
+# Presence: activity is coalesced in memory and flushed to Redis and
+# Profile.last_activity every PRESENCE_FLUSH_INTERVAL seconds.
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 15))
+PRESENCE_FLUSH_BATCH_SIZE = 500
+PRESENCE_RETENTION = 24 * 60 * 60
+# Users seen within this many seconds count as online.
+PRESENCE_ONLINE_WINDOW = 5 * 60
+# ws/presence/ batches friend deltas over this many seconds, and waits this
+# long after a user's last socket closes before announcing them offline.
+PRESENCE_PUSH_INTERVAL = 1
+PRESENCE_OFFLINE_GRACE = 10
+
+# Chat messages are staged in a Redis stream and bulk-inserted by a writer
+# thread (chat.writer) every CHAT_WRITE_INTERVAL seconds or
+# CHAT_WRITE_BATCH_SIZE messages. Entries a crashed writer left unacknowledged
+# for CHAT_WRITE_CLAIM_IDLE seconds are taken over by another; ones the
+# database rejects are kept in a dead-letter stream capped at
+# CHAT_WRITE_DEAD_LETTER_MAXLEN.
+CHAT_WRITE_BATCH_SIZE = 500
+CHAT_WRITE_INTERVAL = 0.5
+CHAT_WRITE_CLAIM_IDLE = 60
+CHAT_WRITE_DEAD_LETTER_MAXLEN = 10000
+CHAT_MESSAGE_MAX_LENGTH = 2000
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+CHAT_SEARCH_MAX_QUERY_LENGTH = 200
+# Unread counters live in Redis and are rebuilt from the database at least this often
+CHAT_UNREAD_TTL = 24 * 60 * 60
+# Per-user offline inboxes (chat.inbox): newest CHAT_INBOX_MAXLEN messages,
+# kept CHAT_INBOX_TTL seconds after the last one arrived
+CHAT_INBOX_MAXLEN = 1000
+CHAT_INBOX_TTL = 7 * 24 * 60 * 60
+# Cleared history is hidden at once and deleted in the background (chat.purge)
+# in batches of CHAT_PURGE_BATCH_SIZE rows, CHAT_PURGE_PAUSE seconds apart.
+# Purges a restart interrupted resume with the next clear in any process, or
+# via `manage.py purge_chat_history`; idle purge threads recheck every
+# CHAT_PURGE_POLL_INTERVAL seconds. Finished purges are kept
+# CHAT_PURGE_RETENTION seconds for late write-behind messages, then dropped.
+CHAT_PURGE_BATCH_SIZE = 1000
+CHAT_PURGE_PAUSE = 0.1
+CHAT_PURGE_POLL_INTERVAL = 30
+CHAT_PURGE_RETENTION = 7 * 24 * 60 * 60
+
+# NumberTap games (core.number_tap): rounds last NUMBER_TAP_DURATION seconds
+# plus NUMBER_TAP_GRACE for late endGame messages, after which the server ends
+# them. Score relays to the opponent are coalesced to one per
+# NUMBER_TAP_RELAY_INTERVAL seconds.
+NUMBER_TAP_DURATION = 30
+NUMBER_TAP_GRACE = 3
+NUMBER_TAP_RELAY_INTERVAL = 0.1
+NUMBER_TAP_MAX_TAPS_PER_SECOND = 10
+NUMBER_TAP_SESSION_TTL = 5 * 60
+# Queued players who haven't been paired in NUMBER_TAP_QUEUE_MAX_WAIT seconds
+# are dropped; the waits of the last NUMBER_TAP_WAIT_SAMPLES pairings feed
+# the queue stats.
+NUMBER_TAP_QUEUE_MAX_WAIT = 10 * 60
+NUMBER_TAP_WAIT_SAMPLES = 1000
+
+# Incoming websocket frames, per connection: {route: {action: (per second, burst)}}.
+# '*' counts every frame on the route; see core/throttling.py.
+WS_RATE_LIMITS = {
+    'chat': {'*': (5, 20)},
+    'game': {'*': (120, 240), 'move': (30, 60), 'ack': (70, 140)},
+    'matchmaking': {'*': (2, 10)},
+    'friends': {'*': (2, 10)},
+    'number_tap': {'*': (20, 40)},
+    'presence': {'*': (1, 5)},
+    'gateway': {'*': (20, 60), 'chat': (5, 20), 'invites': (1, 5), 'matchmaking': (1, 5)},
+}
+# Dropped frames tolerated (per second, burst) before the socket is closed with 4029
+WS_RATE_LIMIT_ABUSE = (1, 30)
+# Game state frames a client may have unacknowledged before newer ones
+# replace the pending frame instead of being sent; see core/mailbox.py.
+GAME_FRAME_WINDOW = 8
+GAME_FRAME_ACK_TIMEOUT = 1
+
 
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'rest_framework_json_api.exceptions.exception_handler',
@@ -126,6 +246,15 @@ REST_FRAMEWORK = {
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Avatars: uploads over the cap are rejected while streaming; a small pool
+# renders square WebP thumbnails, and lists serve the size they display.
+AVATAR_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+AVATAR_THUMBNAIL_SIZES = (64, 256)
+AVATAR_THUMBNAIL_WORKERS = 2
+AVATAR_LIST_SIZE = 64
+AVATAR_PROFILE_SIZE = 256
+# Spool uploads to disk past 256 KB instead of holding them in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -166,6 +295,12 @@ DATABASES = {
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
+# Password hashing runs on a bounded pool (usermanage.hashing); logins and
+# registrations past PASSWORD_HASH_MAX_PENDING get a 503 instead of queueing
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = PASSWORD_HASH_WORKERS * 8
+PASSWORD_HASH_RETRY_AFTER = 1
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
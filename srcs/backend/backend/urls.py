@@ -19,8 +19,6 @@ from django.contrib import admin
 from django.urls import path, include
 from core import views
 from rest_framework import routers
-from django.conf import settings
-from django.conf.urls.static import static
 
 router = routers.DefaultRouter()
 
@@ -30,4 +28,6 @@ urlpatterns += [
     path('admin/', admin.site.urls),
     path('', include('core.urls')),
     path('', include('usermanage.urls')),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('', include('chat.urls')),
+]
+# MEDIA_URL is served by backend.media.MediaFilesHandler in front of Django
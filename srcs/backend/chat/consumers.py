@@ -1,14 +1,66 @@
 # chat/consumers.py
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
+import logging
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from core.throttling import RateLimitedWebsocketConsumer
+from usermanage.consumers import user_group
+from usermanage.friends import are_friends
+from . import inbox, writer
+
+logger = logging.getLogger(__name__)
+
+def room_group(username, other_username):
+    # Sort sender and receiver alphabetically to ensure consistent room name
+    users = sorted([username, other_username])
+    return f'chat_{users[0]}_{users[1]}'
+
+async def relay(channel_layer, sender, receiver, sender_id, receiver_id, message):
+    """
+    Deliver to the legacy per-conversation room and to both users' gateway
+    sockets, and keep a copy in the receiver's inbox for when they're offline.
+    """
+    try:
+        inbox_id = await inbox.push(receiver_id, sender, receiver, message)
+    except Exception as e:
+        logger.error(f"Could not store chat message for {receiver} offline delivery: {str(e)}")
+        inbox_id = None
+    event = {
+        "type": "chat_message",
+        "message": message,
+        "sender": sender,
+        "receiver": receiver,
+        "sender_id": sender_id,
+        "receiver_id": receiver_id,
+        "inbox_id": inbox_id,
+    }
+    for group in dict.fromkeys((room_group(sender, receiver), user_group(receiver_id), user_group(sender_id))):
+        await channel_layer.group_send(group, event)
+
+class ChatConsumer(RateLimitedWebsocketConsumer):
+    rate_limit_scope = 'chat'
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.sender = self.scope['url_route']['kwargs']['sender']
         self.receiver = self.scope['url_route']['kwargs']['receiver']
-        # Sort sender and receiver alphabetically to ensure consistent room name
-        users = sorted([self.sender, self.receiver])
-        self.room_group_name = f'chat_{users[0]}_{users[1]}'
+        # Messages are persisted as coming from the authenticated user
+        user = self.scope['user']
+        if not user.is_authenticated or user.username != self.sender:
+            await self.close(code=4001)
+            return
+        self.sender_id = user.id
+        # Resolved once here so receive() does no database work
+        self.receiver_id = await database_sync_to_async(
+            lambda: User.objects.filter(username=self.receiver).values_list('id', flat=True).first()
+        )()
+        if self.receiver_id is None:
+            await self.close(code=4004)
+            return
+        if not await database_sync_to_async(are_friends)(self.sender_id, self.receiver_id):
+            await self.close(code=4003)
+            return
+        writer.ensure_writer()
+        self.room_group_name = room_group(self.sender, self.receiver)
 
         print(f"Connecting WebSocket: sender={self.sender}, receiver={self.receiver}, room={self.room_group_name}")
 
@@ -20,6 +72,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            return
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -36,14 +90,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         print(f"Received message from {self.sender}: {message}")
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                "type": "chat_message",
-                "message": message,
-                "sender": self.sender,
-            }
-        )
+        try:
+            message = writer.clean_message(message)
+        except ValueError as e:
+            await self.send(text_data=json.dumps({"type": "error", "message": str(e)}))
+            return
+
+        # Staged in Redis; the writer thread bulk-inserts it into ChatMessage
+        try:
+            await writer.enqueue(self.sender_id, self.receiver_id, message)
+        except Exception as e:
+            logger.error(f"Could not stage chat message from {self.sender}: {str(e)}")
+            await self.send(text_data=json.dumps({"type": "error", "message": "Message could not be sent"}))
+            return
+
+        await relay(self.channel_layer, self.sender, self.receiver, self.sender_id, self.receiver_id, message)
 
     async def chat_message(self, event):
         message = event["message"]
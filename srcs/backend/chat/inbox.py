@@ -0,0 +1,97 @@
+import logging
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+from backend.redis_client import async_script, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# Every message relayed to a user is also appended to their inbox, a capped
+# stream. Clients ack the newest entry they have shown; on (re)connect the
+# gateway replays what came after, so a reconnect only fetches the gap.
+# Acked entries are trimmed right away, except the acked one itself: if the
+# oldest entry is newer than the ack, the cap or TTL dropped messages the
+# client never saw and it should reload history instead.
+STREAM_ID = re.compile(r'^\d+-\d+$')
+
+# KEYS: ack, inbox. ARGV: ms, seq, TTL. Moves the ack forward only, so two
+# tabs acking at once can't move it back. Returns 1 if it moved.
+ACK = async_script("""
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ms, seq = string.match(current, '^(%d+)-(%d+)$')
+    ms, seq = tonumber(ms), tonumber(seq)
+    local new_ms, new_seq = tonumber(ARGV[1]), tonumber(ARGV[2])
+    if ms > new_ms or (ms == new_ms and seq >= new_seq) then
+        return 0
+    end
+end
+local inbox_id = ARGV[1] .. '-' .. ARGV[2]
+redis.call('SET', KEYS[1], inbox_id, 'EX', ARGV[3])
+redis.call('XTRIM', KEYS[2], 'MINID', inbox_id)
+return 1
+""")
+
+
+def inbox_key(user_id):
+    return f'chat:inbox:{user_id}'
+
+
+def ack_key(user_id):
+    return f'chat:inbox:{user_id}:ack'
+
+
+def _parse(stream_id):
+    ms, seq = stream_id.split('-')
+    return int(ms), int(seq)
+
+
+async def push(receiver_id, sender, receiver, message):
+    """Append to the receiver's inbox; returns the entry id the client acks."""
+    key = inbox_key(receiver_id)
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.xadd(key, {'sender': sender, 'receiver': receiver, 'message': message},
+              maxlen=settings.CHAT_INBOX_MAXLEN, approximate=True)
+    pipe.expire(key, settings.CHAT_INBOX_TTL)
+    inbox_id, _ = await pipe.execute()
+    return inbox_id.decode()
+
+
+async def ack(user_id, inbox_id):
+    """Mark everything up to inbox_id delivered. Acks older than the current one are ignored."""
+    if not isinstance(inbox_id, str) or not STREAM_ID.match(inbox_id):
+        return False
+    moved = await ACK(keys=[ack_key(user_id), inbox_key(user_id)],
+                      args=[*_parse(inbox_id), settings.CHAT_INBOX_TTL], client=get_async_redis())
+    return bool(moved)
+
+
+async def unacked(user_id):
+    """
+    (entries after the last ack, oldest first, as chat events; whether
+    messages were lost before them).
+    """
+    redis = get_async_redis()
+    key = inbox_key(user_id)
+    last_ack = await redis.get(ack_key(user_id))
+    if last_ack is None:
+        entries = await redis.xrange(key, count=settings.CHAT_INBOX_MAXLEN)
+        gap = False
+    else:
+        last_ack = last_ack.decode()
+        oldest = await redis.xrange(key, count=1)
+        gap = bool(oldest) and _parse(oldest[0][0].decode()) > _parse(last_ack)
+        entries = await redis.xrange(key, min=f'({last_ack}', count=settings.CHAT_INBOX_MAXLEN)
+    return [event(inbox_id.decode(), fields) for inbox_id, fields in entries], gap
+
+
+def event(inbox_id, fields):
+    return {
+        "inbox_id": inbox_id,
+        "sender": fields[b'sender'].decode(),
+        "receiver": fields[b'receiver'].decode(),
+        "message": fields[b'message'].decode(),
+        "timestamp": datetime.fromtimestamp(_parse(inbox_id)[0] / 1000, tz=dt_timezone.utc).isoformat(),
+    }
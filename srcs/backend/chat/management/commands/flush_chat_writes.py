@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from chat import writer
+
+
+class Command(BaseCommand):
+    help = "Write every chat message still staged in Redis to the database, e.g. after a deploy or crash"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-idle', type=float, default=0,
+                            help="Only take over entries other writers have held this many seconds")
+
+    def handle(self, *args, **options):
+        written = writer.drain(int(options['min_idle'] * 1000))
+        self.stdout.write(f"Wrote {written} staged chat messages")
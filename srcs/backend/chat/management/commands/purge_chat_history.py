@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chat import purge
+
+
+class Command(BaseCommand):
+    help = "Finish every pending chat history clear, e.g. ones a restart interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows per DELETE (default CHAT_PURGE_BATCH_SIZE)")
+        parser.add_argument('--pause', type=float, default=None, help="Seconds between batches (default CHAT_PURGE_PAUSE)")
+
+    def handle(self, *args, **options):
+        count = purge.run_pending(options['batch_size'], options['pause'])
+        self.stdout.write(f"Finished {count} pending chat purges")
+        pruned = purge.prune_finished()
+        self.stdout.write(f"Dropped {pruned} purges finished over CHAT_PURGE_RETENTION ago")
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-19 17:20
+
+from django.db import migrations, models
+
+
+def backfill_conversation(apps, schema_editor):
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    pairs = ChatMessage.objects.filter(conversation__isnull=True).values_list('sender_id', 'receiver_id').distinct()
+    for sender_id, receiver_id in pairs.iterator():
+        ChatMessage.objects.filter(sender_id=sender_id, receiver_id=receiver_id).update(
+            conversation=f'{min(sender_id, receiver_id)}:{max(sender_id, receiver_id)}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatmessage_stream_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='conversation',
+            field=models.CharField(editable=False, max_length=41, null=True),
+        ),
+        migrations.RunPython(backfill_conversation, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='conversation',
+            field=models.CharField(editable=False, max_length=41),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_conversation_time_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2 on 2026-10-19 19:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Keeps search_vector current on every INSERT, including the write-behind's
+# bulk_create, and on edits of message. The text search configuration must
+# match chat.models.SEARCH_CONFIG.
+CREATE_TRIGGER = """
+CREATE TRIGGER chat_chatmessage_search_vector_update
+BEFORE INSERT OR UPDATE OF message ON chat_chatmessage
+FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.simple', message);
+"""
+DROP_TRIGGER = "DROP TRIGGER IF EXISTS chat_chatmessage_search_vector_update ON chat_chatmessage;"
+BACKFILL = "UPDATE chat_chatmessage SET search_vector = to_tsvector('pg_catalog.simple', message);"
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGGER)
+        schema_editor.execute(BACKFILL)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chatmessage_unread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-19 19:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0006_chatmessage_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatPurge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation', models.CharField(blank=True, max_length=41, null=True)),
+                ('cutoff', models.DateTimeField()),
+                ('deleted', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chat_purges', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='chatpurge',
+            index=models.Index(condition=models.Q(('finished_at__isnull', True)), fields=['created_at'], name='chat_purge_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatpurge',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('conversation__isnull', False), ('user__isnull', True)), models.Q(('conversation__isnull', True), ('user__isnull', False)), _connector='OR'), name='chat_purge_one_scope'),
+        ),
+    ]
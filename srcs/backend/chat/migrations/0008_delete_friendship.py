@@ -0,0 +1,16 @@
+# Generated by Django 4.2 on 2026-10-19 20:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_chatpurge'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Friendship',
+        ),
+    ]
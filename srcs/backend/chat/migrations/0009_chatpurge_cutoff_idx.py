@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-19 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_delete_friendship'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatpurge',
+            index=models.Index(fields=['cutoff'], name='chat_purge_cutoff_idx'),
+        ),
+    ]
@@ -1,22 +1,80 @@
 # chat/models.py
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth.models import User  # Import User model
+from django.utils import timezone
 
-class Friendship(models.Model):
-    user1 = models.ForeignKey(User, related_name='friendships1', on_delete=models.CASCADE)
-    user2 = models.ForeignKey(User, related_name='friendships2', on_delete=models.CASCADE)
-    status = models.CharField(max_length=10, choices=[('pending', 'Pending'), ('accepted', 'Accepted')], default='pending')
-    created_at = models.DateTimeField(auto_now_add=True)
+# Text search configuration for message search. 'simple' only lowercases:
+# chat is multilingual and full of slang, where stemming does more harm than good.
+SEARCH_CONFIG = 'simple'
+
+def conversation_key(user_id, other_id):
+    """Same for both directions of a conversation: "<lower id>:<higher id>"."""
+    return f'{min(user_id, other_id)}:{max(user_id, other_id)}'
 
 class ChatMessage(models.Model):
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    # Redis stream entry id the write-behind persisted this from (see writer.py)
+    stream_id = models.CharField(max_length=32, unique=True, null=True, blank=True)
+    conversation = models.CharField(max_length=41, editable=False)
     is_read = models.BooleanField(default=False)  # Optional: track if message is read
+    # to_tsvector(SEARCH_CONFIG, message), filled in by a database trigger (migration 0006)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['-timestamp']  # Order by most recent first
+        indexes = [
+            # History pages walk this backwards from a (timestamp, id) cursor
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_conversation_time_idx'),
+            # Only unread rows, for rebuilding unread counters (see unread.py)
+            models.Index(fields=['receiver', 'sender'], condition=models.Q(is_read=False), name='chat_unread_idx'),
+            GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.conversation:
+            self.conversation = conversation_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.sender.username} to {self.receiver.username}: {self.message}"
\ No newline at end of file
+        return f"{self.sender.username} to {self.receiver.username}: {self.message}"
+
+
+class ChatPurge(models.Model):
+    """
+    A pending deletion: messages of `conversation` (or every message `user`
+    sent or received) up to `cutoff`. History and search hide them as soon
+    as the row exists; chat.purge deletes them in batches and then sets
+    finished_at.
+    """
+    conversation = models.CharField(max_length=41, null=True, blank=True)
+    user = models.ForeignKey(User, related_name='chat_purges', null=True, blank=True, on_delete=models.CASCADE)
+    cutoff = models.DateTimeField()
+    deleted = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(conversation__isnull=False, user__isnull=True)
+                | models.Q(conversation__isnull=True, user__isnull=False),
+                name='chat_purge_one_scope',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], condition=models.Q(finished_at__isnull=True), name='chat_purge_pending_idx'),
+            models.Index(fields=['cutoff'], name='chat_purge_cutoff_idx'),
+        ]
+
+    def messages(self):
+        """Every message this purge covers that still exists."""
+        if self.conversation:
+            scope = models.Q(conversation=self.conversation)
+        else:
+            scope = models.Q(sender_id=self.user_id) | models.Q(receiver_id=self.user_id)
+        return ChatMessage.objects.filter(scope, timestamp__lte=self.cutoff)
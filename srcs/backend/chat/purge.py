@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import unread
+
+logger = logging.getLogger(__name__)
+
+# Clearing history writes a ChatPurge tombstone and returns. One thread per
+# process then deletes the covered messages CHAT_PURGE_BATCH_SIZE rows at a
+# time, each batch its own short transaction, pausing CHAT_PURGE_PAUSE
+# seconds between batches so the purge never hogs the database.
+_worker = None
+_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def schedule(conversation=None, user_id=None):
+    """Hide the messages now and queue their deletion. Returns the ChatPurge."""
+    from .models import ChatPurge
+
+    purge = ChatPurge.objects.create(conversation=conversation, user_id=user_id, cutoff=timezone.now())
+    _invalidate_unread(purge)
+    ensure_worker()
+    _wake.set()
+    return purge
+
+
+def visible(messages, user_id, peer_id=None):
+    """
+    Exclude messages hidden by unfinished purges from a queryset of
+    user_id's messages (only those with peer_id if given).
+    """
+    from .models import ChatMessage, ChatPurge, conversation_key
+
+    if peer_id is not None:
+        relevant = Q(conversation=conversation_key(user_id, peer_id)) | Q(user_id__in=[user_id, peer_id])
+    else:
+        # A peer's own purge covers what they exchanged with user_id; other users' don't
+        exchanged = ChatMessage.objects.filter(
+            Q(sender_id=user_id, receiver_id=OuterRef('user_id')) | Q(receiver_id=user_id, sender_id=OuterRef('user_id')),
+        )
+        relevant = (Q(conversation__startswith=f'{user_id}:') | Q(conversation__endswith=f':{user_id}')
+                    | Q(user_id=user_id) | Q(Exists(exchanged)))
+    hidden = Q()
+    for conversation, purged_user_id, cutoff in (ChatPurge.objects.filter(relevant, finished_at__isnull=True)
+                                                 .values_list('conversation', 'user_id', 'cutoff')):
+        if conversation:
+            hidden |= Q(conversation=conversation, timestamp__lte=cutoff)
+        else:
+            hidden |= (Q(sender_id=purged_user_id) | Q(receiver_id=purged_user_id)) & Q(timestamp__lte=cutoff)
+    return messages.exclude(hidden) if hidden else messages
+
+
+def discard_purged(messages):
+    """
+    Delete just-written messages that a purge covers; returns the others.
+    The write-behind stamps messages with their enqueue time, so one staged
+    before a purge's cutoff can reach the table after the purge finished.
+    Called after the insert: a purge scheduled later deletes the rows itself.
+    """
+    from .models import ChatMessage, ChatPurge
+
+    if not messages:
+        return messages
+    user_ids = {message.sender_id for message in messages} | {message.receiver_id for message in messages}
+    purges = list(ChatPurge.objects.filter(
+        Q(conversation__in={message.conversation for message in messages}) | Q(user_id__in=user_ids),
+        cutoff__gte=min(message.timestamp for message in messages),
+    ).values_list('conversation', 'user_id', 'cutoff'))
+    if not purges:
+        return messages
+
+    def covered(message):
+        return any(
+            message.timestamp <= cutoff
+            and (message.conversation == conversation if conversation
+                 else purged_user_id in (message.sender_id, message.receiver_id))
+            for conversation, purged_user_id, cutoff in purges
+        )
+
+    purged = {message.stream_id for message in messages if covered(message)}
+    if purged:
+        ChatMessage.objects.filter(stream_id__in=purged).delete()
+    return [message for message in messages if message.stream_id not in purged]
+
+
+def progress(purge):
+    return {
+        'id': purge.id,
+        'done': purge.finished_at is not None,
+        'deleted': purge.deleted,
+        'remaining': 0 if purge.finished_at else purge.messages().count(),
+        'created_at': purge.created_at.isoformat(),
+        'finished_at': purge.finished_at.isoformat() if purge.finished_at else None,
+    }
+
+
+def _invalidate_unread(purge):
+    if purge.conversation:
+        unread.invalidate(*map(int, purge.conversation.split(':')))
+    else:
+        unread.invalidate(purge.user_id, *purge.messages().filter(sender_id=purge.user_id, is_read=False)
+                          .values_list('receiver_id', flat=True).distinct())
+
+
+def run(purge, batch_size=None, pause=None):
+    """Delete everything purge covers, batch by batch; returns rows deleted. Safe to run concurrently."""
+    from .models import ChatMessage, ChatPurge
+
+    batch_size = batch_size or settings.CHAT_PURGE_BATCH_SIZE
+    pause = settings.CHAT_PURGE_PAUSE if pause is None else pause
+    total = 0
+    while True:
+        ids = list(purge.messages().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted, _ = ChatMessage.objects.filter(id__in=ids).delete()
+        ChatPurge.objects.filter(id=purge.id).update(deleted=F('deleted') + deleted)
+        total += deleted
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    ChatPurge.objects.filter(id=purge.id, finished_at__isnull=True).update(finished_at=timezone.now())
+    # Unread counters rebuilt before the last batch could still include deleted rows
+    _invalidate_unread(purge)
+    logger.info(f"Chat purge {purge.id} finished, {total} messages deleted")
+    return total
+
+
+def run_pending(batch_size=None, pause=None):
+    """Run unfinished purges, oldest first, until none are left."""
+    from .models import ChatPurge
+
+    count = 0
+    while True:
+        purge = ChatPurge.objects.filter(finished_at__isnull=True).order_by('created_at').first()
+        if purge is None:
+            return count
+        run(purge, batch_size, pause)
+        count += 1
+
+
+def prune_finished():
+    """
+    Drop purges finished more than CHAT_PURGE_RETENTION seconds ago, so
+    discard_purged() doesn't check every write against them forever.
+    Returns how many were dropped.
+    """
+    from .models import ChatPurge
+
+    expired = timezone.now() - timedelta(seconds=settings.CHAT_PURGE_RETENTION)
+    deleted, _ = ChatPurge.objects.filter(finished_at__lt=expired).delete()
+    return deleted
+
+
+def _run_worker():
+    while True:
+        _wake.wait(settings.CHAT_PURGE_POLL_INTERVAL)
+        _wake.clear()
+        try:
+            close_old_connections()
+            run_pending()
+            prune_finished()
+        except Exception as e:
+            logger.error(f"Chat purge failed: {str(e)}")
+        finally:
+            close_old_connections()
+
+
+def ensure_worker():
+    """Start this process's purge thread, once."""
+    global _worker
+    if _worker is not None:
+        return
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, name='chat-purge', daemon=True)
+            _worker.start()
@@ -0,0 +1,121 @@
+import logging
+from collections import Counter
+
+import redis
+from django.conf import settings
+from django.db.models import Count
+
+from backend.redis_client import get_redis, script
+
+logger = logging.getLogger(__name__)
+
+# Marks a hash as rebuilt from the database, so "no unread" and "never
+# counted" (or expired) can be told apart.
+SENTINEL = '_'
+
+# KEYS: unread hashes. ARGV: sentinel, ttl, then a (peer id, n) pair per key.
+# Only bumps hashes that reconcile() has built; a missing or expired one is
+# left for the next read to rebuild, since counting into it would create a
+# hash with no sentinel and no TTL, and a rebuild already sees the message.
+INCREMENT = script("""
+for i, key in ipairs(KEYS) do
+    if redis.call('HEXISTS', key, ARGV[1]) == 1 then
+        redis.call('HINCRBY', key, ARGV[2 * i + 1], ARGV[2 * i + 2])
+        redis.call('EXPIRE', key, ARGV[2])
+    end
+end
+""")
+
+
+def unread_key(user_id):
+    """Hash of peer user id -> unread messages from them to user_id."""
+    return f'unread:{user_id}'
+
+
+def count_in_db(user_id):
+    """{peer id: unread count} straight from ChatMessage, served by the partial unread index."""
+    from .models import ChatMessage
+
+    return dict(ChatMessage.objects.filter(receiver_id=user_id, is_read=False)
+                .values_list('sender_id').annotate(n=Count('id')).order_by())
+
+
+def reconcile(user_id):
+    """
+    Replace the user's counters in Redis with the database's numbers. The
+    hash is WATCHed across the count: a write-behind increment landing in
+    between makes it count again rather than being overwritten.
+    """
+    key = unread_key(user_id)
+
+    def swap(pipe):
+        counts = count_in_db(user_id)
+        pipe.multi()
+        pipe.delete(key)
+        pipe.hset(key, mapping={SENTINEL: 0, **counts})
+        pipe.expire(key, settings.CHAT_UNREAD_TTL)
+        return counts
+
+    return get_redis().transaction(swap, key, value_from_callable=True)
+
+
+def get_counts(user_id):
+    """{peer id: unread count}, from Redis when it has them, else rebuilt from the database."""
+    try:
+        stored = get_redis().hgetall(unread_key(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Unread counters unavailable: {str(e)}")
+        stored = {}
+    if SENTINEL.encode() not in stored:
+        try:
+            return reconcile(user_id)
+        except redis.RedisError:
+            return count_in_db(user_id)
+    return {int(peer_id): int(count) for peer_id, count in stored.items()
+            if peer_id != SENTINEL.encode() and int(count) > 0}
+
+
+def invalidate(*user_ids):
+    """Drop the counters so the next read rebuilds them, e.g. after deleting messages."""
+    try:
+        get_redis().delete(*[unread_key(user_id) for user_id in user_ids])
+    except redis.RedisError as e:
+        logger.error(f"Could not invalidate unread counters: {str(e)}")
+
+
+def record_persisted(messages):
+    """Count newly written messages; called by the write-behind after bulk_create."""
+    counts = Counter((message.receiver_id, message.sender_id) for message in messages)
+    if not counts:
+        return
+    keys, args = [], [SENTINEL, settings.CHAT_UNREAD_TTL]
+    for (receiver_id, sender_id), n in counts.items():
+        keys.append(unread_key(receiver_id))
+        args += [sender_id, n]
+    INCREMENT(keys=keys, args=args, client=get_redis())
+
+
+def record_read(user_id, peer_id, n):
+    if n <= 0:
+        return
+    key = unread_key(user_id)
+    remaining = get_redis().hincrby(key, peer_id, -n)
+    if remaining <= 0:
+        get_redis().hdel(key, peer_id)
+
+
+def mark_read(user_id, peer_id, up_to=None):
+    """Mark messages from peer_id to user_id read, up to message id up_to (inclusive), in one UPDATE."""
+    from .models import ChatMessage, conversation_key
+
+    messages = ChatMessage.objects.filter(
+        conversation=conversation_key(user_id, peer_id), receiver_id=user_id, is_read=False,
+    )
+    if up_to is not None:
+        messages = messages.filter(id__lte=up_to)
+    updated = messages.update(is_read=True)
+    try:
+        record_read(user_id, peer_id, updated)
+    except redis.RedisError as e:
+        logger.error(f"Could not update unread counter for {user_id}: {str(e)}")
+    return updated
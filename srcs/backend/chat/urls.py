@@ -6,8 +6,12 @@ websocket_urlpatterns = [
 ]
 
 urlpatterns = [
-    path('chat/history/', views.get_chat_history, name='chat_history'),
-    path('chat/clear/', views.clear_chat_history, name='clear_chat_history'),
-    path('chat/clear_user/', views.clear_user_chat_history, name='clear_user_chat_history'),
+    path('chat/history/', views.ChatHistoryView.as_view(), name='chat_history'),
+    path('chat/search/', views.ChatSearchView.as_view(), name='chat_search'),
+    path('chat/unread/', views.UnreadCountsView.as_view(), name='chat_unread'),
+    path('chat/read/', views.MarkReadView.as_view(), name='chat_mark_read'),
+    path('chat/clear/', views.ClearChatHistoryView.as_view(), name='clear_chat_history'),
+    path('chat/clear_user/', views.ClearUserChatHistoryView.as_view(), name='clear_user_chat_history'),
+    path('chat/purges/<int:purge_id>/', views.ChatPurgeView.as_view(), name='chat_purge'),
     # ... other URL patterns if any ...
 ]
\ No newline at end of file
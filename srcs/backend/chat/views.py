@@ -1,69 +1,226 @@
 
 # chat/views.py
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
 from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
-from .models import ChatMessage
+from django.db.models import Q
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
+from .models import ChatMessage, ChatPurge, SEARCH_CONFIG, conversation_key
+from . import purge, unread
 import json
 
-@csrf_exempt
-def get_chat_history(request):
-    if request.method == 'GET':
+def encode_cursor(timestamp, message_id):
+    return f'{int(timestamp.timestamp() * 1_000_000)}_{message_id}'
+
+def decode_cursor(cursor):
+    micros, message_id = cursor.split('_')
+    return datetime.fromtimestamp(int(micros) / 1_000_000, tz=dt_timezone.utc), int(message_id)
+
+class ChatHistoryView(APIView):
+    """
+    GET chat/history/?sender=<username>&receiver=<username>[&before=<cursor>][&limit=<n>]
+
+    Newest page first; pass `before` from the previous response to page back.
+    Messages inside a page are oldest first. Each page is one index range
+    scan on (conversation, timestamp, id), however long the conversation is.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
         sender_name = request.GET.get('sender')
         receiver_name = request.GET.get('receiver')
         if not sender_name or not receiver_name:
             return JsonResponse({'error': 'Sender and receiver are required'}, status=400)
+        if request.user.username not in (sender_name, receiver_name):
+            return JsonResponse({'error': 'Not a participant in this conversation'}, status=403)
 
-        try:
-            sender = User.objects.get(username=sender_name)
-            receiver = User.objects.get(username=receiver_name)
-        except User.DoesNotExist:
+        ids = dict(User.objects.filter(username__in=[sender_name, receiver_name]).values_list('username', 'id'))
+        if sender_name not in ids or receiver_name not in ids:
             return JsonResponse({'error': 'User not found'}, status=404)
+        sender_id = ids[sender_name]
 
-        # Fetch messages between sender and receiver, ordered by timestamp
-        messages = ChatMessage.objects.filter(
-            (models.Q(sender=sender, receiver=receiver) | models.Q(sender=receiver, receiver=sender))
-        ).order_by('timestamp')
+        try:
+            limit = min(int(request.GET.get('limit', settings.CHAT_HISTORY_PAGE_SIZE)), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+            before = decode_cursor(request.GET['before']) if request.GET.get('before') else None
+        except (ValueError, OverflowError, OSError):
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+
+        messages = ChatMessage.objects.filter(conversation=conversation_key(sender_id, ids[receiver_name]))
+        messages = purge.visible(messages, sender_id, ids[receiver_name])
+        if before:
+            timestamp, message_id = before
+            messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+        rows = list(messages.order_by('-timestamp', '-id').values('id', 'sender_id', 'message', 'timestamp')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
 
-        # Serialize messages to match the conversations structure (text, type, time)
         message_list = [{
-            'text': msg.message,
-            'type': 'sender' if msg.sender.username == sender_name else 'receiver',
-            'time': msg.timestamp.isoformat(),
-        } for msg in messages]
-
-        return JsonResponse({'messages': message_list}, status=200)
-
-@csrf_exempt
-def clear_chat_history(request):
-    if request.method == 'POST':
-        sender_name = request.POST.get('sender')
-        receiver_name = request.POST.get('receiver')
+            'id': row['id'],
+            'text': row['message'],
+            'type': 'sender' if row['sender_id'] == sender_id else 'receiver',
+            'time': row['timestamp'].isoformat(),
+        } for row in reversed(rows)]
+
+        return JsonResponse({
+            'messages': message_list,
+            'before': encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more else None,
+        }, status=200)
+
+class ChatSearchView(APIView):
+    """
+    GET chat/search/?q=<words>[&with=<username>][&before=<cursor>][&limit=<n>]
+
+    The requester's messages (sent or received) matching q, newest first,
+    optionally only the conversation with one user. q takes web search
+    syntax: words, "quoted phrases", -excluded. Served by the GIN index on
+    search_vector; pages follow the same `before` cursor as chat/history/.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        terms = request.GET.get('q', '').strip()
+        if not terms:
+            return JsonResponse({'error': 'q is required'}, status=400)
+        if len(terms) > settings.CHAT_SEARCH_MAX_QUERY_LENGTH:
+            return JsonResponse({'error': 'q is too long'}, status=400)
+
+        try:
+            limit = min(int(request.GET.get('limit', settings.CHAT_HISTORY_PAGE_SIZE)), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+            before = decode_cursor(request.GET['before']) if request.GET.get('before') else None
+        except (ValueError, OverflowError, OSError):
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+
+        user_id = request.user.id
+        peer_name = request.GET.get('with')
+        if peer_name:
+            peer_id = User.objects.filter(username=peer_name).values_list('id', flat=True).first()
+            if peer_id is None:
+                return JsonResponse({'error': 'User not found'}, status=404)
+            messages = ChatMessage.objects.filter(conversation=conversation_key(user_id, peer_id))
+        else:
+            peer_id = None
+            messages = ChatMessage.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+        messages = purge.visible(messages, user_id, peer_id)
+
+        messages = messages.filter(search_vector=SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch'))
+        if before:
+            timestamp, message_id = before
+            messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+        rows = list(messages.order_by('-timestamp', '-id').values(
+            'id', 'message', 'timestamp', 'sender__username', 'receiver__username',
+        )[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return JsonResponse({
+            'results': [{
+                'id': row['id'],
+                'text': row['message'],
+                'sender': row['sender__username'],
+                'receiver': row['receiver__username'],
+                'time': row['timestamp'].isoformat(),
+            } for row in rows],
+            'before': encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more else None,
+        }, status=200)
+
+class UnreadCountsView(APIView):
+    """GET chat/unread/: every conversation with unread messages for the requester, in one call."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        counts = unread.get_counts(request.user.id)
+        usernames = dict(User.objects.filter(id__in=counts).values_list('id', 'username'))
+        return JsonResponse({
+            'unread': [{'user_id': peer_id, 'username': usernames.get(peer_id), 'count': count}
+                       for peer_id, count in counts.items() if peer_id in usernames],
+            'total': sum(count for peer_id, count in counts.items() if peer_id in usernames),
+        }, status=200)
+
+class MarkReadView(APIView):
+    """
+    POST chat/read/ {"peer": <username>, "up_to": <message id, optional>}
+    Marks the peer's messages to the requester as read, up to and including
+    up_to (everything so far if omitted).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        peer_name = request.data.get('peer')
+        if not peer_name:
+            return JsonResponse({'error': 'peer is required'}, status=400)
+        peer_id = User.objects.filter(username=peer_name).values_list('id', flat=True).first()
+        if peer_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        up_to = request.data.get('up_to')
+        try:
+            up_to = int(up_to) if up_to is not None else None
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'up_to must be a message id'}, status=400)
+        updated = unread.mark_read(request.user.id, peer_id, up_to)
+        return JsonResponse({'marked_read': updated}, status=200)
+
+class ChatPurgeView(APIView):
+    """GET chat/purges/<id>/: progress of a history clear, for the user(s) it concerns."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, purge_id):
+        chat_purge = ChatPurge.objects.filter(id=purge_id).first()
+        if chat_purge is None:
+            return JsonResponse({'error': 'Not found'}, status=404)
+        if chat_purge.conversation:
+            allowed = str(request.user.id) in chat_purge.conversation.split(':')
+        else:
+            allowed = chat_purge.user_id == request.user.id
+        if not allowed:
+            return JsonResponse({'error': 'Not found'}, status=404)
+        return JsonResponse(purge.progress(chat_purge), status=200)
+
+# Both clears return at once: the messages disappear from history and search
+# immediately and are deleted in the background (see purge.py). Poll
+# chat/purges/<purge_id>/ for progress.
+
+class ClearChatHistoryView(APIView):
+    """POST chat/clear/ {"sender": <username>, "receiver": <username>}; the requester must be one of them."""
+    permission_classes = [IsAuthenticated]
+    # Clients predating the login requirement post forms rather than JSON
+    parser_classes = [JSONParser, FormParser, MultiPartParser]
+
+    def post(self, request):
+        sender_name = request.data.get('sender')
+        receiver_name = request.data.get('receiver')
         if not sender_name or not receiver_name:
             return JsonResponse({'error': 'Sender and receiver are required'}, status=400)
+        if request.user.username not in (sender_name, receiver_name):
+            return JsonResponse({'error': 'Not a participant in this conversation'}, status=403)
 
         try:
             sender = User.objects.get(username=sender_name)
             receiver = User.objects.get(username=receiver_name)
-            ChatMessage.objects.filter(
-                (models.Q(sender=sender, receiver=receiver) | models.Q(sender=receiver, receiver=sender))
-            ).delete()
-            return JsonResponse({'message': 'Chat history cleared successfully'}, status=200)
+            chat_purge = purge.schedule(conversation=conversation_key(sender.id, receiver.id))
+            return JsonResponse({'message': 'Chat history cleared successfully', 'purge_id': chat_purge.id}, status=202)
         except User.DoesNotExist:
             return JsonResponse({'error': 'User not found'}, status=404)
 
-@csrf_exempt
-def clear_user_chat_history(request):
-    if request.method == 'POST':
-        username = request.POST.get('username')
+class ClearUserChatHistoryView(APIView):
+    """POST chat/clear_user/ {"username": <username>}: clears the requester's own history only."""
+    permission_classes = [IsAuthenticated]
+    # Clients predating the login requirement post forms rather than JSON
+    parser_classes = [JSONParser, FormParser, MultiPartParser]
+
+    def post(self, request):
+        username = request.data.get('username')
         if not username:
             return JsonResponse({'error': 'Username is required'}, status=400)
+        if username != request.user.username:
+            return JsonResponse({'error': 'You can only clear your own chat history'}, status=403)
 
-        try:
-            user = User.objects.get(username=username)
-            ChatMessage.objects.filter(
-                models.Q(sender=user) | models.Q(receiver=user)
-            ).delete()
-            return JsonResponse({'message': 'User chat history cleared successfully'}, status=200)
-        except User.DoesNotExist:
-            return JsonResponse({'error': 'User not found'}, status=404)
+        chat_purge = purge.schedule(user_id=request.user.id)
+        return JsonResponse({'message': 'User chat history cleared successfully', 'purge_id': chat_purge.id}, status=202)
@@ -0,0 +1,217 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+from backend.redis_client import get_async_redis, get_redis
+from . import purge, unread
+
+logger = logging.getLogger(__name__)
+
+# Messages wait here until a writer has them in the database. Entries are
+# XACKed and XDELed only after bulk_create, so a crash between reading and
+# writing leaves them pending for another writer to XAUTOCLAIM.
+STREAM_KEY = 'chat:writeback'
+GROUP = 'chat-writers'
+# Entries the database rejected (a sender deleted since, say), acked off the
+# main stream so they don't hold back the rest of their batch.
+DEAD_LETTER_KEY = 'chat:writeback:dead'
+
+# What inserting a single bad row can raise; psycopg2 refuses NUL bytes with ValueError
+ROW_ERRORS = (IntegrityError, DataError, ValueError)
+
+_consumer = f'{socket.gethostname()}-{os.getpid()}'
+_writer = None
+_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def clean_message(message):
+    """The message as it will be stored; raises ValueError if it can't be."""
+    if not isinstance(message, str):
+        raise ValueError("Message must be a string")
+    # Postgres text can't hold NUL
+    message = message.replace('\x00', '')
+    if not message:
+        raise ValueError("Message is empty")
+    if len(message) > settings.CHAT_MESSAGE_MAX_LENGTH:
+        raise ValueError(f"Message is longer than {settings.CHAT_MESSAGE_MAX_LENGTH} characters")
+    return message
+
+
+async def enqueue(sender_id, receiver_id, message):
+    """
+    Stage a chat message for writing. Returns its stream id, which becomes
+    ChatMessage.stream_id; its millisecond part is the message timestamp.
+    """
+    message = clean_message(message)
+    stream_id = await get_async_redis().xadd(STREAM_KEY, {
+        'sender': sender_id,
+        'receiver': receiver_id,
+        'message': message,
+    })
+    return stream_id.decode()
+
+
+def _ensure_group(r):
+    try:
+        r.xgroup_create(STREAM_KEY, GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _to_message(stream_id, fields):
+    from .models import ChatMessage, conversation_key
+
+    stream_id = stream_id.decode()
+    sender_id, receiver_id = int(fields[b'sender']), int(fields[b'receiver'])
+    return ChatMessage(
+        stream_id=stream_id,
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        conversation=conversation_key(sender_id, receiver_id),
+        message=fields[b'message'].decode(),
+        timestamp=datetime.fromtimestamp(int(stream_id.split('-')[0]) / 1000, tz=dt_timezone.utc),
+    )
+
+
+def write(r, entries):
+    """
+    bulk_create the entries, count them as unread, then drop them from the
+    stream. Redelivered ones are skipped by stream_id. If the database
+    rejects the batch, rows are retried one at a time and the ones it still
+    rejects go to DEAD_LETTER_KEY.
+    """
+    from .models import ChatMessage
+
+    if not entries:
+        return 0
+    messages = []
+    rejected = []
+    for stream_id, fields in entries:
+        try:
+            messages.append(_to_message(stream_id, fields))
+        except (KeyError, ValueError) as e:
+            rejected.append((stream_id, fields, e))
+    written = set(ChatMessage.objects.filter(stream_id__in=[message.stream_id for message in messages])
+                  .values_list('stream_id', flat=True))
+    messages = [message for message in messages if message.stream_id not in written]
+    try:
+        ChatMessage.objects.bulk_create(messages, batch_size=settings.CHAT_WRITE_BATCH_SIZE, ignore_conflicts=True)
+    except ROW_ERRORS as e:
+        logger.warning(f"Chat write-behind batch of {len(messages)} rejected, retrying row by row: {str(e)}")
+        fields_by_id = {stream_id.decode(): fields for stream_id, fields in entries}
+        saved = []
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    ChatMessage.objects.bulk_create([message], ignore_conflicts=True)
+            except ROW_ERRORS as e:
+                rejected.append((message.stream_id.encode(), fields_by_id[message.stream_id], e))
+            else:
+                saved.append(message)
+        messages = saved
+    messages = purge.discard_purged(messages)
+    unread.record_persisted(messages)
+    ids = [stream_id for stream_id, _ in entries]
+    pipe = r.pipeline(transaction=False)
+    for stream_id, fields, error in rejected:
+        logger.error(f"Chat message {stream_id.decode()} moved to {DEAD_LETTER_KEY}: {str(error)}")
+        pipe.xadd(DEAD_LETTER_KEY, {**fields, b'stream_id': stream_id, b'error': str(error)},
+                  maxlen=settings.CHAT_WRITE_DEAD_LETTER_MAXLEN, approximate=True)
+    pipe.xack(STREAM_KEY, GROUP, *ids)
+    pipe.xdel(STREAM_KEY, *ids)
+    pipe.execute()
+    return len(entries)
+
+
+def claim_stale(r, min_idle_ms):
+    """Take over entries another writer read but never acknowledged (it crashed or was killed)."""
+    entries = []
+    start = '0-0'
+    while True:
+        start, claimed, _ = r.xautoclaim(STREAM_KEY, GROUP, _consumer, min_idle_ms, start_id=start,
+                                         count=settings.CHAT_WRITE_BATCH_SIZE)
+        entries.extend(claimed)
+        if start in (b'0-0', '0-0') or not claimed:
+            return entries
+
+
+def _read_batch(r):
+    """Collect up to CHAT_WRITE_BATCH_SIZE entries, waiting at most CHAT_WRITE_INTERVAL seconds."""
+    size = settings.CHAT_WRITE_BATCH_SIZE
+    deadline = time.monotonic() + settings.CHAT_WRITE_INTERVAL
+    entries = []
+    while len(entries) < size and not _stopping.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        response = r.xreadgroup(GROUP, _consumer, {STREAM_KEY: '>'}, count=size - len(entries),
+                                block=max(int(remaining * 1000), 1))
+        if response:
+            entries.extend(response[0][1])
+    return entries
+
+
+def drain(min_idle_ms=0):
+    """Write everything currently staged, including entries other writers left pending for min_idle_ms."""
+    r = get_redis()
+    _ensure_group(r)
+    written = write(r, claim_stale(r, min_idle_ms))
+    while True:
+        response = r.xreadgroup(GROUP, _consumer, {STREAM_KEY: '>'}, count=settings.CHAT_WRITE_BATCH_SIZE)
+        entries = response[0][1] if response else []
+        if not entries:
+            return written
+        written += write(r, entries)
+
+
+def _run_writer():
+    r = get_redis()
+    last_claim = 0
+    while not _stopping.is_set():
+        try:
+            _ensure_group(r)
+            entries = _read_batch(r)
+            if time.monotonic() - last_claim > settings.CHAT_WRITE_CLAIM_IDLE:
+                entries += claim_stale(r, int(settings.CHAT_WRITE_CLAIM_IDLE * 1000))
+                last_claim = time.monotonic()
+            if entries:
+                close_old_connections()
+                write(r, entries)
+        except Exception as e:
+            logger.error(f"Chat write-behind failed: {str(e)}")
+            time.sleep(settings.CHAT_WRITE_INTERVAL)
+
+
+def _shutdown():
+    _stopping.set()
+    _writer.join(timeout=settings.CHAT_WRITE_INTERVAL + 1)
+    try:
+        # Entries this process read but didn't write yet are still pending
+        # under its consumer name; reading from id 0 returns them.
+        r = get_redis()
+        response = r.xreadgroup(GROUP, _consumer, {STREAM_KEY: '0'})
+        write(r, response[0][1] if response else [])
+    except Exception as e:
+        logger.error(f"Chat write-behind shutdown flush failed: {str(e)}")
+
+
+def ensure_writer():
+    """Start this process's writer thread, once."""
+    global _writer
+    if _writer is not None:
+        return
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_run_writer, name='chat-writer', daemon=True)
+            _writer.start()
+            atexit.register(_shutdown)
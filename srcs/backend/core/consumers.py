@@ -1,6 +1,5 @@
 import json
 import redis.asyncio as aioredis
-from channels.generic.websocket import AsyncWebsocketConsumer
 from rest_framework.permissions import IsAuthenticated
 from channels.layers import get_channel_layer
 import asyncio
@@ -11,30 +10,28 @@ import random
 import math
 import jwt
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken, TokenError
 from django.contrib.auth.models import User
-from rest_framework_simplejwt.backends import TokenBackend
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from .models import NumberTapMatch
 from django.conf import settings
 import json
 import logging
-from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from .models import NumberTapMatch
+from usermanage.friends import are_friends
+from backend.redis_client import get_async_redis
+from usermanage.middleware import get_user_for_token
+from . import number_tap
+from .gateway import JOIN_QUEUE, MATCHMAKING_GROUP, MATCHMAKING_QUEUE_KEY
+from .mailbox import LatestFrameMailbox
+from .throttling import RateLimitedWebsocketConsumer
 
 logger = logging.getLogger(__name__)
 
-class MatchmakingConsumer(AsyncWebsocketConsumer):
+class MatchmakingConsumer(RateLimitedWebsocketConsumer):
+    rate_limit_scope = 'matchmaking'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.redis = None
-        self.redis_host = os.environ.get('REDIS_HOST', 'redis')
-        self.redis_port = int(os.environ.get('REDIS_PORT', 6379))
         self.user_id = None
         self.channel_layer = get_channel_layer()
         self.auth_token = None
@@ -42,22 +39,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         await self.accept()
         self.user_id = self.scope['user'].username if self.scope['user'].is_authenticated else f"anon_{id(self)}"
-        max_retries = 5
-        retry_delay = 2
-        for attempt in range(max_retries):
-            try:
-                self.redis = await aioredis.from_url(f"redis://{self.redis_host}:{self.redis_port}")
-                break
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    await self.send(text_data=json.dumps({
-                        "type": "error",
-                        "message": "Failed to connect to matchmaking service"
-                    }))
-                    await self.close()
-                    return
-                await asyncio.sleep(retry_delay)
-        await self.channel_layer.group_add("matchmaking", self.channel_name)
+        await self.channel_layer.group_add(MATCHMAKING_GROUP, self.channel_name)
         await self.send(text_data=json.dumps({
             "type": "connected",
             "user_id": self.user_id
@@ -65,9 +47,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         if self.channel_layer and self.channel_name:
-            await self.channel_layer.group_discard("matchmaking", self.channel_name)
-        if self.redis:
-            await self.redis.close()
+            await self.channel_layer.group_discard(MATCHMAKING_GROUP, self.channel_name)
         logger.info(f"Player {self.user_id} disconnected with code: {close_code}")
 
     async def receive(self, text_data):
@@ -82,16 +62,12 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error in receive for {self.user_id}: {str(e)}")
 
-    @database_sync_to_async
-    def validate_token(self, token):
-        """Validate the JWT token and return the username."""
-        try:
-            access_token = AccessToken(token)
-            user = get_user_model().objects.get(id=access_token['user_id'])
-            return user.username
-        except (TokenError, get_user_model().DoesNotExist) as e:
-            logger.error(f"Token validation failed: {str(e)}")
-            return None
+    async def validate_token(self, token):
+        """Return the username of the handshake user, falling back to the token."""
+        user = self.scope['user']
+        if not user.is_authenticated:
+            user = await get_user_for_token(token)
+        return user.username if user else None
 
     async def join_queue(self, event):
         try:
@@ -104,91 +80,48 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
                 return
 
             self.user_id = validated_username
-            queue_contents = await self.get_queue_contents()
-            if self.user_id in queue_contents:
-                logger.info(f"User {self.user_id} already in queue")
-                return
-
-            await self.add_to_queue(self.user_id)
+            # Same script as the gateway, so both sockets share one queue
+            players = await JOIN_QUEUE(keys=[MATCHMAKING_QUEUE_KEY], args=[self.user_id], client=get_async_redis())
             await self.send(text_data=json.dumps({
                 "type": "joined_queue",
                 "user_id": self.user_id
             }))
 
-            queue_size = await self.get_queue_size()
-
-            if queue_size >= 2:
-                player1_id = await self.get_first_in_queue()
-                player2_id = await self.get_first_in_queue()
-                if player1_id and player2_id:
-                    game_group_name = f"game_{player1_id}_{player2_id}_{int(asyncio.get_event_loop().time())}"
-                    
-                    your_role = "player1" if self.user_id == player1_id else "player2"
-
-                    match_data = {
-                        "type": "match_found",
-                        "player1_id": player1_id,
-                        "player2_id": player2_id,
-                        "game_group_name": game_group_name,
-                        "your_role": your_role
-                    }
-                    
-                    await self.channel_layer.group_send("matchmaking", {
-                        "type": "match_found",
-                        "data": match_data
-                    })
-            else:
+            if isinstance(players, int):
                 await self.send(text_data=json.dumps({
                     "type": "waiting",
-                    "queue_size": queue_size
+                    "queue_size": players
                 }))
-        except Exception as e:
-            logger.error(f"Error in join_queue: {str(e)}")
-
-    async def get_queue_contents(self):
-        try:
-            contents = await self.redis.lrange("matchmaking_queue", 0, -1)
-            return [item.decode('utf-8') for item in contents] if contents else []
-        except Exception as e:
-            logger.error(f"Error getting queue contents: {str(e)}")
-            return []
+                return
 
-    async def get_queue_size(self):
-        try:
-            size = await self.redis.llen("matchmaking_queue")
-            return size or 0
-        except Exception as e:
-            logger.error(f"Error getting queue size: {str(e)}")
-            return 0
+            player1_id, player2_id = (player.decode() for player in players)
+            game_group_name = f"game_{player1_id}_{player2_id}_{int(asyncio.get_event_loop().time())}"
 
-    async def add_to_queue(self, user_id):
-        try:
-            await self.redis.rpush("matchmaking_queue", user_id)
-            logger.info(f"Added {user_id} to queue")
-        except Exception as e:
-            logger.error(f"Error adding to queue: {str(e)}")
+            your_role = "player1" if self.user_id == player1_id else "player2"
 
-    async def get_first_in_queue(self):
-        try:
-            user_id = await self.redis.lpop("matchmaking_queue")
-            return user_id.decode('utf-8') if user_id else None
-        except Exception as e:
-            logger.error(f"Error getting first in queue: {str(e)}")
-            return None
+            match_data = {
+                "type": "match_found",
+                "player1_id": player1_id,
+                "player2_id": player2_id,
+                "game_group_name": game_group_name,
+                "your_role": your_role
+            }
 
-    async def remove_user_from_queue(self, user_id):
-        try:
-            await self.redis.lrem("matchmaking_queue", 1, user_id)
-            logger.info(f"Removed {user_id} from queue")
+            await self.channel_layer.group_send(MATCHMAKING_GROUP, {
+                "type": "match_found",
+                "data": match_data
+            })
         except Exception as e:
-            logger.error(f"Error removing from queue: {str(e)}")
+            logger.error(f"Error in join_queue: {str(e)}")
 
     async def match_found(self, event):
         data = event["data"]
         logger.info(f"Sending match_found to {self.user_id}: {data}")
         await self.send(text_data=json.dumps(data))
 
-class GameConsumer(AsyncWebsocketConsumer):
+class GameConsumer(RateLimitedWebsocketConsumer):
+    rate_limit_scope = 'game'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.game_group_name = None
@@ -198,6 +131,10 @@ class GameConsumer(AsyncWebsocketConsumer):
         self.redis_port = int(os.environ.get('REDIS_PORT', 6379))
         self.channel_layer = get_channel_layer()
         self.loop_task = None
+        self.paddle_speed = 0
+        # game_update frames go through here; see game_update()
+        self.outbox = LatestFrameMailbox(self.send, self.rate_limit_scope,
+                                         settings.GAME_FRAME_WINDOW, settings.GAME_FRAME_ACK_TIMEOUT)
 
     async def connect(self):
         self.game_group_name = self.scope['url_route']['kwargs']['game_group_name']
@@ -253,6 +190,9 @@ class GameConsumer(AsyncWebsocketConsumer):
                     self.loop_task = asyncio.create_task(self.game_loop())
 
     async def disconnect(self, close_code):
+        self.outbox.close()
+        if self.outbox.dropped:
+            logger.info(f"{self.user_id} skipped {self.outbox.dropped} stale frames in {self.game_group_name}")
         await self.channel_layer.group_discard(self.game_group_name, self.channel_name)
         game_state_key = f"game_state:{self.game_group_name}"
         lock_key = f"lock:{self.game_group_name}"
@@ -274,31 +214,31 @@ class GameConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         data = json.loads(text_data)
-        if data['action'] == 'move':
+        if data['action'] == 'ack':
+            self.outbox.ack(data.get('seq'))
+        elif data['action'] == 'move':
+            player_role = self.game_state["players"].get(self.user_id)
+            if not player_role:
+                return
+            speed = 0.3
+            if data['key'] in ['a', 'ArrowLeft']:
+                speed_x = -speed if player_role == "player1" else speed
+            elif data['key'] in ['d', 'ArrowRight']:
+                speed_x = speed if player_role == "player1" else -speed
+            else:
+                speed_x = 0
+            # Held keys repeat; only a change of direction needs the locked write
+            if speed_x == self.paddle_speed:
+                return
             game_state_key = f"game_state:{self.game_group_name}"
             lock_key = f"lock:{self.game_group_name}"
             async with self.redis.lock(lock_key, timeout=5):
                 stored_state = await self.redis.get(game_state_key)
                 if stored_state:
                     self.game_state = json.loads(stored_state)
-                    player_role = self.game_state["players"].get(self.user_id)
-                    if player_role:
-                        speed = 0.3
-                        if player_role == "player1":
-                            if data['key'] in ['a', 'ArrowLeft']:
-                                self.game_state["paddles"][player_role]["speed_x"] = -speed
-                            elif data['key'] in ['d', 'ArrowRight']:
-                                self.game_state["paddles"][player_role]["speed_x"] = speed
-                            else:
-                                self.game_state["paddles"][player_role]["speed_x"] = 0
-                        elif player_role == "player2":
-                            if data['key'] in ['a', 'ArrowLeft']:
-                                self.game_state["paddles"][player_role]["speed_x"] = speed
-                            elif data['key'] in ['d', 'ArrowRight']:
-                                self.game_state["paddles"][player_role]["speed_x"] = -speed
-                            else:
-                                self.game_state["paddles"][player_role]["speed_x"] = 0
-                        await self.redis.set(game_state_key, json.dumps(self.game_state))
+                    self.game_state["paddles"][player_role]["speed_x"] = speed_x
+                    await self.redis.set(game_state_key, json.dumps(self.game_state))
+                    self.paddle_speed = speed_x
 
     async def game_loop(self):
         game_state_key = f"game_state:{self.game_group_name}"
@@ -420,8 +360,11 @@ class GameConsumer(AsyncWebsocketConsumer):
         }
 
     async def game_update(self, event):
+        # Only the newest state matters: a frame the client hasn't been sent
+        # yet is replaced rather than queued behind, so a slow connection
+        # costs one frame of memory and never falls behind the game.
         state = event["game_state"]
-        await self.send(text_data=json.dumps({
+        self.outbox.put({
             "type": "game_update",
             "paddle1_x": state["paddles"]["player1"]["x"],
             "paddle2_x": state["paddles"]["player2"]["x"],
@@ -431,9 +374,10 @@ class GameConsumer(AsyncWebsocketConsumer):
             "ball_velocity_z": state["ball"]["vz"],
             "score1": state["scores"]["player1"],
             "score2": state["scores"]["player2"]
-        }))
+        })
 
     async def game_ended(self, event):
+        self.outbox.close()
         await self.send(text_data=json.dumps({
             "type": "game_ended",
             "message": event["message"]
@@ -441,7 +385,9 @@ class GameConsumer(AsyncWebsocketConsumer):
 
 import uuid
 
-class FriendsMatchConsumer(AsyncWebsocketConsumer):
+class FriendsMatchConsumer(RateLimitedWebsocketConsumer):
+    rate_limit_scope = 'friends'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.redis = None
@@ -488,15 +434,12 @@ class FriendsMatchConsumer(AsyncWebsocketConsumer):
         elif action == "accept_invite":
             await self.handle_accept_invite(data)
 
-    @database_sync_to_async
-    def validate_token(self, token):
-        try:
-            access_token = AccessToken(token)
-            user = get_user_model().objects.get(id=access_token['user_id'])
-            return user.username
-        except Exception as e:
-            logger.error(f"Instance {self.instance_id}: Token validation failed: {e}")
-            return None
+    async def validate_token(self, token):
+        """Return the username of the handshake user, falling back to the token."""
+        user = self.scope['user']
+        if not user.is_authenticated:
+            user = await get_user_for_token(token)
+        return user.username if user else None
 
     async def handle_authenticate(self, data):
         auth_token = data.get('authToken')
@@ -515,11 +458,19 @@ class FriendsMatchConsumer(AsyncWebsocketConsumer):
         await self.redis.hset("connected_users", self.user_id, self.channel_name)
         await self.send(json.dumps({"type": "authenticated", "message": "Authentication successful"}))
 
+    @database_sync_to_async
+    def is_friend(self, friend_username):
+        ids = dict(User.objects.filter(username__in=[self.user_id, friend_username]).values_list('username', 'id'))
+        return self.user_id in ids and friend_username in ids and are_friends(ids[self.user_id], ids[friend_username])
+
     async def handle_invite_friend(self, data):
         friend_username = data.get('friend_username')
         if not friend_username:
             await self.send(json.dumps({"type": "error", "message": "Friend username required"}))
             return
+        if not await self.is_friend(friend_username):
+            await self.send(json.dumps({"type": "error", "message": f"{friend_username} is not your friend"}))
+            return
 
         friend_channel = await self.redis.hget("connected_users", friend_username)
         invite_key = f"invite:{self.user_id}:{friend_username}"
@@ -598,7 +549,9 @@ class FriendsMatchConsumer(AsyncWebsocketConsumer):
 
 #############################################
 
-class NumberTapConsumer(AsyncWebsocketConsumer):
+class NumberTapConsumer(RateLimitedWebsocketConsumer):
+    rate_limit_scope = 'number_tap'
+
     async def connect(self):
         logger.debug(f"NumberTapConsumer.connect() scope: {self.scope}")
         self.user = self.scope['user']
@@ -620,6 +573,16 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
     async def disconnect(self, close_code):
         username = getattr(self, 'username', 'unknown_user')  # Safely handle missing username
         logger.info(f"Disconnecting NumberTapConsumer for user: {username}, close_code: {close_code}")
+        if getattr(self, 'queued', False):
+            await number_tap.leave_queue(self.username)
+        if getattr(self, 'session_id', None):
+            for task in (self.relay_task, self.deadline_task):
+                if task and not task.done():
+                    task.cancel()
+            # Leaving before the end forfeits with the scores so far; a player
+            # who already finished leaves the ending to the opponent or the deadline.
+            if not self.done:
+                await self.finish()
         if hasattr(self, 'room_group_name'):
             try:
                 await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
@@ -634,6 +597,8 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
         logger.info(f"Received data: {data}")
 
         if data['type'] == 'join':
+            if hasattr(self, 'username'):
+                return  # already joined during the handshake
             token = data.get('token')
             if not token:
                 await self.close(code=4001, reason='No authentication token provided')
@@ -650,39 +615,32 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
             logger.info(f"User {self.username} joined successfully")
             await self.matchmake()
         elif data['type'] == 'score':
-            if hasattr(self, 'opponent'):
-                await self.channel_layer.group_send(
-                    f'number_tap_{self.opponent}',
-                    {'type': 'score_update', 'score': data['score']}
-                )
-            else:
-                logger.warning(f"No opponent set for {self.username} to send score update")
+            if not getattr(self, 'session_id', None) or self.done:
+                logger.warning(f"No game in progress for {getattr(self, 'username', 'unknown_user')} to score in")
+                return
+            score = data.get('score')
+            if not number_tap.plausible_score(score, self.started_at):
+                logger.warning(f"Ignoring implausible NumberTap score {score!r} from {self.username}")
+                return
+            if not await number_tap.record_score(self.session_id, self.username, score):
+                await self.session_expired()
+                return
+            self.relay_score(score)
         elif data['type'] == 'endGame':
-            if hasattr(self, 'opponent'):
-                await self.channel_layer.group_send(
-                    f'number_tap_{self.opponent}',
-                    {'type': 'end_game', 'opponentScore': data['opponentScore']}
-                )
-                await self.store_match_history(data['opponentScore'])
-            else:
-                logger.warning(f"No opponent set for {self.username} to end game")
+            # The client's own score was already reported; endGame only says its clock ran out
+            if not getattr(self, 'session_id', None) or self.done:
+                return
+            self.done = True
+            both_done = await number_tap.mark_done(self.session_id, self.username)
+            if both_done is None:
+                await self.session_expired()
+            elif both_done:
+                await self.finish()
 
     async def authenticate_token(self, token):
-        try:
-            token_backend = TokenBackend(
-                algorithm='HS256',
-                signing_key=settings.SIMPLE_JWT.get('SIGNING_KEY', settings.SECRET_KEY)
-            )
-            decoded_token = token_backend.decode(token, verify=True)
-            user_id = decoded_token.get('user_id')
-            if not user_id:
-                logger.error("Token missing user_id")
-                return None
-            user = await database_sync_to_async(User.objects.get)(id=user_id)
-            return user
-        except (InvalidToken, TokenError, User.DoesNotExist) as e:
-            logger.error(f"Token authentication error: {str(e)}")
-            return None
+        if self.scope['user'].is_authenticated:
+            return self.scope['user']
+        return await get_user_for_token(token)
 
     async def matchmake(self):
         if not hasattr(self, 'username'):
@@ -690,33 +648,22 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
             return
         logger.info(f"Starting matchmaking for user: {self.username}")
         try:
-            redis = await aioredis.from_url("redis://redis:6379")  # Match Docker service name
-            waiting_player = await redis.get("number_tap_waiting")
-            if waiting_player:
-                opponent = waiting_player.decode('utf-8')
-                if opponent == self.username:  # Prevent matching with self
-                    logger.warning(f"User {self.username} cannot match with themselves")
-                    await redis.close()
-                    return
-                await redis.delete("number_tap_waiting")
-                self.opponent = opponent
+            opponent = await number_tap.pair_or_enqueue(self.username)
+            if opponent:
+                session_id, started_at = await number_tap.create_session(opponent, self.username)
                 await self.channel_layer.group_send(
                     f'number_tap_{opponent}',
-                    {'type': 'match_found', 'opponent': self.username}
+                    {'type': 'match_found', 'opponent': self.username, 'session_id': session_id, 'started_at': started_at}
                 )
-                await self.send(text_data=json.dumps({
-                    'type': 'matchFound',
-                    'opponent': opponent,
-                }))
+                await self.match_found({'opponent': opponent, 'session_id': session_id, 'started_at': started_at})
             else:
-                await redis.set("number_tap_waiting", self.username)
+                self.queued = True
                 await self.send(text_data=json.dumps({
                     'type': 'waiting',
                     'message': 'Waiting for an opponent...'
                 }))
-            await redis.close()
-        except redis.exceptions.ConnectionError as e:
-            logger.error(f"Failed to connect to Redis: {str(e)}")
+        except aioredis.RedisError as e:
+            logger.error(f"NumberTap matchmaking failed: {str(e)}")
             await self.send(text_data=json.dumps({
                 'type': 'error',
                 'message': 'Matchmaking unavailable due to server issues. Please try again later.'
@@ -726,12 +673,54 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
     async def match_found(self, event):
         opponent = event['opponent']
         self.opponent = opponent
+        self.queued = False
+        self.session_id = event['session_id']
+        self.started_at = event['started_at']
+        self.done = False
+        self.pending_score = None
+        self.last_relay = 0
+        self.relay_task = None
+        self.deadline_task = asyncio.create_task(self.finish_at_deadline())
         logger.info(f"Match found for {self.username} with opponent: {opponent}")
         await self.send(text_data=json.dumps({
             'type': 'matchFound',
             'opponent': opponent,
         }))
 
+    def relay_score(self, score):
+        """Pass the newest score on to the opponent, at most once per NUMBER_TAP_RELAY_INTERVAL."""
+        self.pending_score = score
+        if self.relay_task is None or self.relay_task.done():
+            self.relay_task = asyncio.create_task(self.flush_score())
+
+    async def flush_score(self):
+        # Scores arriving during a send wait for the next pass, not the next tap
+        while self.pending_score is not None:
+            await asyncio.sleep(max(0, self.last_relay + settings.NUMBER_TAP_RELAY_INTERVAL - time.monotonic()))
+            score, self.pending_score = self.pending_score, None
+            self.last_relay = time.monotonic()
+            await self.channel_layer.group_send(f'number_tap_{self.opponent}', {'type': 'score_update', 'score': score})
+
+    async def finish_at_deadline(self):
+        await asyncio.sleep(max(0, number_tap.deadline(self.started_at) - time.time()))
+        await self.finish()
+
+    async def finish(self):
+        """End the game for both players, if nobody has yet."""
+        scores = await number_tap.finalize(self.session_id)
+        if scores is None:
+            return
+        for player, opponent in ((self.username, self.opponent), (self.opponent, self.username)):
+            await self.channel_layer.group_send(
+                f'number_tap_{player}',
+                {'type': 'end_game', 'opponentScore': scores[opponent]}
+            )
+
+    async def session_expired(self):
+        """The shared game state is gone, so nobody can finalize it: end the game here with what this socket saw."""
+        logger.warning(f"NumberTap session {self.session_id} of {self.username} expired")
+        await self.end_game({'opponentScore': getattr(self, 'opponentScore', 0)})
+
     async def score_update(self, event):
         score = event['score']
         self.opponentScore = score  # Store opponent's score
@@ -742,6 +731,7 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
         }))
 
     async def end_game(self, event):
+        self.done = True
         opponentScore = event['opponentScore']
         logger.info(f"Sending endGame to client, opponentScore: {opponentScore}")
         await self.send(text_data=json.dumps({
@@ -749,20 +739,4 @@ class NumberTapConsumer(AsyncWebsocketConsumer):
             'opponentScore': opponentScore,
         }))
 
-    @database_sync_to_async
-    def store_match_history(self, opponent_score):
-        try:
-            match = NumberTapMatch(
-                player1=self.user,
-                player2=User.objects.get(username=self.opponent),
-                player1_score=opponent_score,  # Player1's score is what the opponent sent
-                player2_score=self.opponentScore if hasattr(self, 'opponentScore') else 0  # Player2's score from updates
-            )
-            match.save()
-            logger.info(f"Match history stored for {self.user.username} vs {self.opponent}")
-        except User.DoesNotExist:
-            logger.error(f"Opponent {self.opponent} not found")
-        except Exception as e:
-            logger.error(f"Error storing match history: {str(e)}")
-
 ##############################################
\ No newline at end of file
@@ -0,0 +1,275 @@
+import json
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+
+from backend.redis_client import async_script, get_async_redis
+from chat import inbox, writer
+from chat.consumers import relay
+from usermanage.consumers import PresenceConsumer, user_group
+from usermanage.friends import are_friends
+
+logger = logging.getLogger(__name__)
+
+# Shared with FriendsMatchConsumer / MatchmakingConsumer so gateway and
+# legacy sockets can invite and queue against each other.
+CONNECTED_USERS_KEY = "connected_users"
+MATCHMAKING_QUEUE_KEY = "matchmaking_queue"
+MATCHMAKING_GROUP = "matchmaking"
+INVITE_TTL = 600
+
+# KEYS: queue. ARGV: username. Queues the caller unless already queued
+# (from another socket) and, once two are waiting, pops the oldest pair in
+# the same call, so concurrent joins can neither split a pair, leave two
+# players waiting, nor pair a user with themselves. Returns the pair, or
+# the queue length.
+JOIN_QUEUE = async_script("""
+if not redis.call('LPOS', KEYS[1], ARGV[1]) then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+local size = redis.call('LLEN', KEYS[1])
+if size < 2 then
+    return size
+end
+return redis.call('LPOP', KEYS[1], 2)
+""")
+
+
+class GatewayConsumer(PresenceConsumer):
+    """
+    ws/gateway/: one authenticated socket per user carrying every realtime
+    stream. Client messages are {"stream": ..., "action": ..., ...} and
+    every server message carries the "stream" it belongs to.
+
+    - presence:    friends' snapshot then deltas, as ws/presence/ (always on)
+    - chat:        {"action": "send", "to": username, "message": ...}; every
+                   conversation arrives here, no socket per conversation.
+                   Incoming messages carry an "inbox_id"; {"action": "ack",
+                   "id": ...} the newest one shown. Unacked messages are
+                   replayed (marked "replayed") at connect, preceded by
+                   {"type": "resync"} if some were lost
+    - invites:     {"action": "invite", "friend_username": ...},
+                   {"action": "accept", "inviter": ...}
+    - matchmaking: {"action": "join"} / {"action": "leave"}; only subscribed
+                   to queue broadcasts while queued
+
+    Subscriptions are the server's business: the socket joins the user's
+    own groups at connect and the matchmaking group only while queued.
+
+    Frames are rate limited per stream, see WS_RATE_LIMITS['gateway'].
+    """
+    rate_limit_scope = 'gateway'
+
+    async def connect(self):
+        user = self.scope['user']
+        if user.is_authenticated:
+            # Joined before the handshake completes so no chat message slips past
+            self.username = user.username
+            self.user_ids = {self.username: user.id}
+            self.queued = False
+            await self.channel_layer.group_add(user_group(user.id), self.channel_name)
+            await get_async_redis().hset(CONNECTED_USERS_KEY, self.username, self.channel_name)
+            writer.ensure_writer()
+        await super().connect()
+        if user.is_authenticated:
+            await self.replay_inbox()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'user_id'):
+            return
+        await super().disconnect(close_code)
+        await self.channel_layer.group_discard(user_group(self.user_id), self.channel_name)
+        redis = get_async_redis()
+        if self.queued:
+            await self.leave_queue()
+        # Another socket (a newer tab, a legacy ws/friends/) may have taken over the entry
+        if await redis.hget(CONNECTED_USERS_KEY, self.username) == self.channel_name.encode():
+            await redis.hdel(CONNECTED_USERS_KEY, self.username)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            stream = data["stream"]
+            action = data["action"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            await self.send_stream("gateway", {"type": "error", "message": "Expected {stream, action}"})
+            return
+        handler = getattr(self, f"handle_{stream}", None)
+        if handler is None:
+            await self.send_stream("gateway", {"type": "error", "message": f"Unknown stream {stream}"})
+            return
+        try:
+            await handler(action, data)
+        except Exception as e:
+            logger.error(f"Gateway {stream}/{action} failed for {self.username}: {str(e)}")
+            await self.send_stream(stream, {"type": "error", "message": "Request failed"})
+
+    def rate_limit_action(self, raw):
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+        return data.get("stream") if isinstance(data, dict) else None
+
+    async def send_stream(self, stream, payload):
+        await self.send(text_data=json.dumps({"stream": stream, **payload}))
+
+    async def resolve_user_id(self, username):
+        """Username -> id, looked up once per partner for the life of the socket."""
+        if username not in self.user_ids:
+            self.user_ids[username] = await database_sync_to_async(
+                lambda: User.objects.filter(username=username).values_list('id', flat=True).first()
+            )()
+        return self.user_ids[username]
+
+    # presence
+
+    async def send_states(self, states):
+        await self.send_stream("presence", {
+            "type": "presence",
+            "online": [user_id for user_id, online in states.items() if online],
+            "offline": [user_id for user_id, online in states.items() if not online],
+        })
+
+    # chat
+
+    async def replay_inbox(self):
+        # A message relayed while we read can also arrive live; clients drop inbox_ids they've seen
+        try:
+            events, gap = await inbox.unacked(self.user_id)
+        except Exception as e:
+            logger.error(f"Could not replay chat inbox for {self.username}: {str(e)}")
+            return
+        if gap:
+            await self.send_stream("chat", {"type": "resync"})
+        for event in events:
+            await self.send_stream("chat", {"type": "chat", "replayed": True, **event})
+
+    async def handle_chat(self, action, data):
+        if action == "ack":
+            await inbox.ack(self.user_id, data.get("id"))
+            return
+        if action != "send":
+            return
+        receiver, message = data.get("to"), data.get("message")
+        if not receiver or not isinstance(message, str) or not message:
+            await self.send_stream("chat", {"type": "error", "message": "to and message are required"})
+            return
+        try:
+            message = writer.clean_message(message)
+        except ValueError as e:
+            await self.send_stream("chat", {"type": "error", "message": str(e)})
+            return
+        receiver_id = await self.resolve_user_id(receiver)
+        if receiver_id is None:
+            await self.send_stream("chat", {"type": "error", "message": f"User {receiver} not found"})
+            return
+        if not await database_sync_to_async(are_friends)(self.user_id, receiver_id):
+            await self.send_stream("chat", {"type": "error", "message": f"{receiver} is not your friend"})
+            return
+        await writer.enqueue(self.user_id, receiver_id, message)
+        await relay(self.channel_layer, self.username, receiver, self.user_id, receiver_id, message)
+
+    async def chat_message(self, event):
+        await self.send_stream("chat", {
+            "type": "chat",
+            "message": event["message"],
+            "sender": event["sender"],
+            "receiver": event.get("receiver"),
+            # Only the receiver acks; the sender's echo carries the other inbox's id
+            "inbox_id": event.get("inbox_id") if event.get("receiver_id") == self.user_id else None,
+        })
+
+    # invites
+
+    async def handle_invites(self, action, data):
+        redis = get_async_redis()
+        if action == "invite":
+            friend_username = data.get("friend_username")
+            if not friend_username:
+                await self.send_stream("invites", {"type": "error", "message": "Friend username required"})
+                return
+            friend_id = await self.resolve_user_id(friend_username)
+            if friend_id is None or not await database_sync_to_async(are_friends)(self.user_id, friend_id):
+                await self.send_stream("invites", {"type": "error", "message": f"{friend_username} is not your friend"})
+                return
+            await redis.set(f"invite:{self.username}:{friend_username}", self.username, ex=INVITE_TTL)
+            friend_channel = await redis.hget(CONNECTED_USERS_KEY, friend_username)
+            if not friend_channel:
+                await self.send_stream("invites", {"type": "waiting", "message": f"{friend_username} is not online"})
+                return
+            await self.channel_layer.send(friend_channel.decode(), {"type": "invite_received", "inviter": self.username})
+            await self.send_stream("invites", {"type": "invite_sent", "message": f"Invite sent to {friend_username}"})
+
+        elif action == "accept":
+            inviter = data.get("inviter")
+            # GETDEL: two accepts racing can't both start a match
+            if not inviter or await redis.getdel(f"invite:{inviter}:{self.username}") is None:
+                await self.send_stream("invites", {"type": "error", "message": "No valid invite found"})
+                return
+            inviter_channel = await redis.hget(CONNECTED_USERS_KEY, inviter)
+            if not inviter_channel:
+                await self.send_stream("invites", {"type": "error", "message": "Inviter is no longer online"})
+                return
+            match_data = {
+                "type": "match_found",
+                "player1_id": inviter,
+                "player2_id": self.username,
+                "game_group_name": f"game_{inviter}_{self.username}_{int(time.time())}",
+            }
+            event = {"type": "match_found", "stream": "invites", "data": match_data}
+            await self.channel_layer.send(inviter_channel.decode(), event)
+            await self.channel_layer.send(self.channel_name, event)
+
+    async def invite_received(self, event):
+        await self.send_stream("invites", {"type": "invite_received", "inviter": event["inviter"]})
+
+    # matchmaking
+
+    async def handle_matchmaking(self, action, data):
+        if action == "join":
+            await self.join_queue()
+        elif action == "leave":
+            await self.leave_queue()
+            await self.send_stream("matchmaking", {"type": "left_queue"})
+
+    async def join_queue(self):
+        if self.queued:
+            return
+        await self.channel_layer.group_add(MATCHMAKING_GROUP, self.channel_name)
+        self.queued = True
+        players = await JOIN_QUEUE(keys=[MATCHMAKING_QUEUE_KEY], args=[self.username], client=get_async_redis())
+        await self.send_stream("matchmaking", {"type": "joined_queue", "user_id": self.username})
+        if isinstance(players, int):
+            await self.send_stream("matchmaking", {"type": "waiting", "queue_size": players})
+            return
+        player1_id, player2_id = (player.decode() for player in players)
+        await self.channel_layer.group_send(MATCHMAKING_GROUP, {
+            "type": "match_found",
+            "stream": "matchmaking",
+            "data": {
+                "type": "match_found",
+                "player1_id": player1_id,
+                "player2_id": player2_id,
+                "game_group_name": f"game_{player1_id}_{player2_id}_{int(time.time())}",
+            },
+        })
+
+    async def leave_queue(self):
+        self.queued = False
+        await self.channel_layer.group_discard(MATCHMAKING_GROUP, self.channel_name)
+        await get_async_redis().lrem(MATCHMAKING_QUEUE_KEY, 0, self.username)
+
+    async def match_found(self, event):
+        data = dict(event["data"])
+        # Legacy consumers don't tag the stream; only MatchmakingConsumer sets your_role
+        stream = event.get("stream") or ("matchmaking" if "your_role" in data else "invites")
+        if stream == "matchmaking":
+            if self.username not in (data["player1_id"], data["player2_id"]):
+                return
+            data["your_role"] = "player1" if self.username == data["player1_id"] else "player2"
+            self.queued = False
+            await self.channel_layer.group_discard(MATCHMAKING_GROUP, self.channel_name)
+        await self.send_stream(stream, data)
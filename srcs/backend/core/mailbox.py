@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from . import throttling
+
+
+class LatestFrameMailbox:
+    """
+    Outbound slot holding only the newest frame for a socket. put() never
+    waits; a writer task sends whatever is newest, numbered with a "seq".
+    ASGI send() returns as soon as the server has the frame, not when the
+    client does, so the writer paces itself on the client's acks instead:
+    at most `window` frames go unacknowledged (see ack()). A slow client
+    therefore skips frames rather than piling them up in the transport. An
+    ack overdue by `ack_timeout` seconds is taken as lost.
+    Replaced frames are counted (per connection and under the route's
+    'stale_dropped' counter) and never serialized.
+    """
+    __slots__ = ('send', 'scope', 'window', 'ack_timeout', 'frame', 'ready', 'acked_event',
+                 'task', 'sent', 'acked', 'dropped', 'closed')
+
+    def __init__(self, send, scope, window, ack_timeout):
+        self.send = send
+        self.scope = scope
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.frame = None
+        self.ready = asyncio.Event()
+        self.acked_event = asyncio.Event()
+        self.task = None
+        self.sent = 0
+        self.acked = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame):
+        if self.closed:
+            return
+        if self.frame is not None:
+            self.dropped += 1
+            throttling.count(self.scope, 'stale_dropped')
+        self.frame = frame
+        self.ready.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self.drain())
+
+    def ack(self, seq):
+        """The client has every frame up to `seq`."""
+        if isinstance(seq, int) and self.acked < seq <= self.sent:
+            self.acked = seq
+            self.acked_event.set()
+
+    async def drain(self):
+        while True:
+            await self.ready.wait()
+            while self.sent - self.acked >= self.window:
+                self.acked_event.clear()
+                try:
+                    await asyncio.wait_for(self.acked_event.wait(), self.ack_timeout)
+                except asyncio.TimeoutError:
+                    self.acked = self.sent
+            self.ready.clear()
+            frame, self.frame = self.frame, None
+            if frame is not None:
+                self.sent += 1
+                frame['seq'] = self.sent
+                await self.send(text_data=json.dumps(frame))
+
+    def close(self):
+        """Discard any pending frame and stop the writer; later put()s are ignored."""
+        self.closed = True
+        self.frame = None
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,205 @@
+import logging
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from backend.redis_client import async_script, get_async_redis, get_redis
+from .models import NumberTapMatch
+
+logger = logging.getLogger(__name__)
+
+# A NumberTap game is a Redis hash both players' consumers share, whichever
+# process they're in: player1, player2, started_at, score:<username> and
+# done:<username>. The server keeps the clock and the scores; the first
+# consumer to HSETNX `finalized` writes the single NumberTapMatch.
+POINTS_PER_TAP = 10
+
+# Players waiting for a game: a sorted set of username -> time they joined.
+# Pairing is one Lua call, so any number of simultaneous joiners each get a
+# distinct opponent or a place in the queue. Recent waits feed queue_stats().
+QUEUE_KEY = 'number_tap:queue'
+WAIT_SAMPLES_KEY = 'number_tap:queue:waits'
+
+# KEYS: queue, wait samples. ARGV: username, now, oldest join time still
+# valid, samples kept. Returns {opponent, their join time} or nil once queued.
+PAIR = async_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[3])
+local waiting = redis.call('ZRANGE', KEYS[1], 0, 1, 'WITHSCORES')
+for i = 1, #waiting, 2 do
+    if waiting[i] ~= ARGV[1] then
+        redis.call('ZREM', KEYS[1], waiting[i], ARGV[1])
+        redis.call('LPUSH', KEYS[2], tonumber(ARGV[2]) - tonumber(waiting[i + 1]))
+        redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[4]) - 1)
+        return {waiting[i], waiting[i + 1]}
+    end
+end
+redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1])
+return nil
+""")
+
+
+# KEYS: session. Sets `finalized` unless it is set already or the session
+# expired (HSETNX alone would recreate the key with no TTL). Returns 1 if set.
+FINALIZE = async_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+return redis.call('HSETNX', KEYS[1], 'finalized', 1)
+""")
+
+
+# KEYS: session. ARGV: field, value. HSET only while the session exists, so a
+# late write can't recreate an expired one. Returns 0 if it had expired.
+SET_IF_EXISTS = async_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+""")
+
+# KEYS: session. ARGV: username. Marks username done, guarded like
+# SET_IF_EXISTS. Returns 1 if both players are now done, 0 if not, -1 if the
+# session expired.
+MARK_DONE = async_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'done:' .. ARGV[1], 1)
+local players = redis.call('HMGET', KEYS[1], 'player1', 'player2')
+if redis.call('HEXISTS', KEYS[1], 'done:' .. players[1]) == 1
+        and redis.call('HEXISTS', KEYS[1], 'done:' .. players[2]) == 1 then
+    return 1
+end
+return 0
+""")
+
+
+def session_key(session_id):
+    return f'number_tap:session:{session_id}'
+
+
+async def create_session(player1, player2):
+    """Start a game between two usernames now; returns (session id, started_at)."""
+    session_id = uuid.uuid4().hex
+    started_at = time.time()
+    key = session_key(session_id)
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.hset(key, mapping={
+        'player1': player1,
+        'player2': player2,
+        'started_at': started_at,
+        f'score:{player1}': 0,
+        f'score:{player2}': 0,
+    })
+    pipe.expire(key, settings.NUMBER_TAP_SESSION_TTL)
+    await pipe.execute()
+    return session_id, started_at
+
+
+def deadline(started_at):
+    return started_at + settings.NUMBER_TAP_DURATION + settings.NUMBER_TAP_GRACE
+
+
+def plausible_score(score, started_at, now=None):
+    """
+    Whether a reported score could have been reached by now: a multiple of
+    5 (taps are +10 or -5, floored at 0) from at most NUMBER_TAP_MAX_TAPS_PER_SECOND
+    correct taps a second, inside the game's time.
+    """
+    if not isinstance(score, int) or isinstance(score, bool) or score < 0 or score % 5:
+        return False
+    now = time.time() if now is None else now
+    if now > deadline(started_at):
+        return False
+    elapsed = max(now - started_at, 1)
+    return score <= POINTS_PER_TAP * settings.NUMBER_TAP_MAX_TAPS_PER_SECOND * elapsed
+
+
+async def record_score(session_id, username, score):
+    """Store username's score; returns False if the session expired, i.e. the game is over."""
+    return bool(await SET_IF_EXISTS(keys=[session_key(session_id)], args=[f'score:{username}', score],
+                                    client=get_async_redis()))
+
+
+async def mark_done(session_id, username):
+    """
+    Note that username's game is over; returns whether both players are now
+    done, or None if the session expired (the game is over regardless).
+    """
+    result = await MARK_DONE(keys=[session_key(session_id)], args=[username], client=get_async_redis())
+    return None if result < 0 else bool(result)
+
+
+async def finalize(session_id):
+    """
+    End the game once: returns {username: score} for the caller that won the
+    HSETNX (after writing the NumberTapMatch), None for everyone else.
+    """
+    key = session_key(session_id)
+    if not await FINALIZE(keys=[key], client=get_async_redis()):
+        return None
+    state = {field.decode(): value.decode() for field, value in (await get_async_redis().hgetall(key)).items()}
+    if 'player1' not in state:
+        return None
+    scores = {
+        state['player1']: int(state[f'score:{state["player1"]}']),
+        state['player2']: int(state[f'score:{state["player2"]}']),
+    }
+    await store_match(state['player1'], state['player2'], scores)
+    return scores
+
+
+@database_sync_to_async
+def store_match(player1, player2, scores):
+    users = {user.username: user for user in User.objects.filter(username__in=[player1, player2])}
+    if len(users) < 2:
+        logger.error(f"NumberTap match {player1} vs {player2} not stored: player missing")
+        return
+    # save() picks the winner
+    NumberTapMatch.objects.create(
+        player1=users[player1],
+        player2=users[player2],
+        player1_score=scores[player1],
+        player2_score=scores[player2],
+    )
+    logger.info(f"NumberTap match stored: {player1} {scores[player1]} - {scores[player2]} {player2}")
+
+
+async def pair_or_enqueue(username):
+    """The opponent username waiting longest, removing them from the queue; or None after queueing username."""
+    now = time.time()
+    result = await PAIR(
+        keys=[QUEUE_KEY, WAIT_SAMPLES_KEY],
+        args=[username, now, now - settings.NUMBER_TAP_QUEUE_MAX_WAIT, settings.NUMBER_TAP_WAIT_SAMPLES],
+        client=get_async_redis(),
+    )
+    return result[0].decode() if result else None
+
+
+async def leave_queue(username):
+    await get_async_redis().zrem(QUEUE_KEY, username)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+
+def queue_stats():
+    """Queue length and percentiles (seconds) of the last NUMBER_TAP_WAIT_SAMPLES waits before a match."""
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.zcard(QUEUE_KEY)
+    pipe.lrange(WAIT_SAMPLES_KEY, 0, -1)
+    queued, samples = pipe.execute()
+    waits = sorted(float(sample) for sample in samples)
+    return {
+        'queued': queued,
+        'samples': len(waits),
+        'wait_p50': percentile(waits, 0.5),
+        'wait_p90': percentile(waits, 0.9),
+        'wait_p99': percentile(waits, 0.99),
+        'wait_max': waits[-1] if waits else None,
+    }
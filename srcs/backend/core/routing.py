@@ -1,9 +1,11 @@
 from django.urls import re_path
 from .consumers import MatchmakingConsumer, GameConsumer, FriendsMatchConsumer, NumberTapConsumer
+from .gateway import GatewayConsumer
 
 websocket_urlpatterns = [
 	re_path(r'ws/matchmaking/$', MatchmakingConsumer.as_asgi()),
     re_path(r'ws/game/(?P<game_group_name>[^/]+)/$', GameConsumer.as_asgi()),
 	re_path(r'ws/friends/$', FriendsMatchConsumer.as_asgi()),
 	re_path(r'ws/number-tap/$', NumberTapConsumer.as_asgi()), 
+	re_path(r'ws/gateway/$', GatewayConsumer.as_asgi()),
 ]
\ No newline at end of file
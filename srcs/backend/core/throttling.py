@@ -0,0 +1,110 @@
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Process-wide {scope: Counter(allowed=, dropped=, closed=)}, see stats()
+_counters = defaultdict(Counter)
+
+RATE_LIMITED_CLOSE_CODE = 4029
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def count(scope, name, n=1):
+    _counters[scope][name] += n
+
+
+def stats():
+    return {scope: dict(counts) for scope, counts in _counters.items()}
+
+
+class RateLimitedWebsocketConsumer(AsyncWebsocketConsumer):
+    """
+    Token-bucket limits on incoming frames, per connection, before receive()
+    runs. WS_RATE_LIMITS[rate_limit_scope] maps an action (see
+    rate_limit_action) to (per second, burst); '*' covers every frame.
+    Frames over the limit are dropped, with one {"type": "rate_limited"}
+    notice. A socket that keeps getting dropped past WS_RATE_LIMIT_ABUSE is
+    closed with 4029.
+    """
+    rate_limit_scope = None
+
+    async def websocket_receive(self, message):
+        if self.rate_limit_scope and not await self.allow_frame(message.get('text') or message.get('bytes')):
+            return
+        await super().websocket_receive(message)
+
+    def rate_limit_action(self, raw):
+        """Name of the action a frame performs, to pick its bucket."""
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+        return data.get('action') if isinstance(data, dict) else None
+
+    async def allow_frame(self, raw):
+        limits = settings.WS_RATE_LIMITS.get(self.rate_limit_scope, {})
+        if not limits:
+            return True
+        # Lazily created, so quiet sockets carry a single small dict at most
+        buckets = self.__dict__.setdefault('_rate_buckets', {})
+        now = time.monotonic()
+        keys = ['*'] if '*' in limits else []
+        if len(limits) > len(keys):
+            action = self.rate_limit_action(raw)
+            if action in limits:
+                keys.append(action)
+
+        allowed = True
+        for key in keys:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = TokenBucket(*limits[key])
+            if not bucket.take(now):
+                allowed = False
+                break
+
+        counters = _counters[self.rate_limit_scope]
+        if allowed:
+            counters['allowed'] += 1
+            self._rate_limited = False
+            return True
+
+        counters['dropped'] += 1
+        if getattr(self, '_rate_closing', False):
+            return False
+        abuse = buckets.get('abuse')
+        if abuse is None:
+            abuse = buckets['abuse'] = TokenBucket(*settings.WS_RATE_LIMIT_ABUSE)
+        if not abuse.take(now):
+            counters['closed'] += 1
+            self._rate_closing = True
+            logger.warning(f"Closing {self.rate_limit_scope} socket {self.channel_name}: sustained rate limit violations")
+            await self.close(code=RATE_LIMITED_CLOSE_CODE)
+        elif not getattr(self, '_rate_limited', False):
+            self._rate_limited = True
+            await self.send(text_data=json.dumps({"type": "rate_limited"}))
+        return False
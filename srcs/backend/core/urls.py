@@ -6,4 +6,6 @@ urlpatterns = [
     path('game/', views.GameInitView.as_view(), name='game_init'),
     path('match-history/', views.MatchHistoryView.as_view(), name='match_history'),
     path('number-tap-history/', NumberTapMatchHistoryView.as_view(), name='number_tap_history'),
+    path('number-tap/queue-stats/', views.NumberTapQueueStatsView.as_view(), name='number_tap_queue_stats'),
+    path('ws-rate-limits/', views.SocketRateLimitStatsView.as_view(), name='ws_rate_limits'),
 ]
\ No newline at end of file
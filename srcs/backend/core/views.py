@@ -109,4 +109,22 @@ class NumberTapMatchHistoryView(APIView):
                 'wins': wins,
                 'losses': losses,
             }
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+from rest_framework.permissions import IsAdminUser
+from . import number_tap, throttling
+
+class SocketRateLimitStatsView(APIView):
+    """Websocket rate limiter counters for this process, per route."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return JsonResponse(throttling.stats())
+
+
+class NumberTapQueueStatsView(APIView):
+    """Players waiting for a NumberTap game and how long recent ones waited."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return JsonResponse(number_tap.queue_stats())
@@ -0,0 +1,117 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Q
+
+from .friends import get_friend_ids
+
+
+class UsernameIndex:
+    """
+    Per-process sorted array of (lowercased username, user id) answering
+    prefix queries with bisect. Built from the database on first use and
+    kept fresh by the User post_save/post_delete receivers in models.py;
+    renames made by another process show up here after a restart. Those
+    receivers run on request threads, so reads hold the lock too (a scan
+    is one bisect plus at most `limit` steps).
+    """
+    def __init__(self):
+        self._keys = []
+        self._usernames = {}
+        self._lock = threading.Lock()
+        self._built = False
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            rows = User.objects.filter(is_active=True).values_list('id', 'username')
+            self._usernames = dict(rows)
+            self._keys = sorted((username.lower(), user_id) for user_id, username in self._usernames.items())
+            self._built = True
+
+    def add(self, user_id, username):
+        if not self._built:
+            return
+        with self._lock:
+            self._discard(user_id)
+            self._usernames[user_id] = username
+            insort(self._keys, (username.lower(), user_id))
+
+    def remove(self, user_id):
+        if not self._built:
+            return
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id):
+        username = self._usernames.pop(user_id, None)
+        if username is None:
+            return
+        i = bisect_left(self._keys, (username.lower(), user_id))
+        if i < len(self._keys) and self._keys[i] == (username.lower(), user_id):
+            del self._keys[i]
+
+    def username(self, user_id):
+        self._ensure_built()
+        with self._lock:
+            return self._usernames.get(user_id)
+
+    def prefix(self, prefix, limit):
+        """Up to `limit` (user_id, username) pairs starting with prefix, alphabetically."""
+        self._ensure_built()
+        prefix = prefix.lower()
+        matches = []
+        with self._lock:
+            keys = self._keys
+            i = bisect_left(keys, (prefix,))
+            while i < len(keys) and len(matches) < limit and keys[i][0].startswith(prefix):
+                user_id = keys[i][1]
+                matches.append((user_id, self._usernames[user_id]))
+                i += 1
+        return matches
+
+
+username_index = UsernameIndex()
+
+
+def recent_peer_ids(user_id):
+    """Users this user exchanged chat messages with most recently, newest first."""
+    key = f'recent_peers:{user_id}'
+    peer_ids = cache.get(key)
+    if peer_ids is None:
+        from chat.models import ChatMessage
+        rows = ChatMessage.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id)) \
+            .order_by('-timestamp').values_list('sender_id', 'receiver_id')[:100]
+        peer_ids = list(dict.fromkeys(
+            receiver_id if sender_id == user_id else sender_id for sender_id, receiver_id in rows
+        ))
+        cache.set(key, peer_ids, settings.AUTOCOMPLETE_RECENT_PEERS_TIMEOUT)
+    return peer_ids
+
+
+def autocomplete(user_id, prefix, limit):
+    """
+    Top `limit` usernames starting with prefix: friends first, then recent
+    chat partners, then everyone else alphabetically. The requester is excluded.
+    """
+    prefix = prefix.lower()
+    ranked = {}
+
+    def consider(candidate_ids):
+        for candidate_id in candidate_ids:
+            username = username_index.username(candidate_id)
+            if username and username.lower().startswith(prefix) and candidate_id != user_id:
+                ranked.setdefault(candidate_id, username)
+
+    consider(sorted(get_friend_ids(user_id), key=lambda friend_id: (username_index.username(friend_id) or '').lower()))
+    consider(recent_peer_ids(user_id))
+    if len(ranked) < limit:
+        consider(candidate_id for candidate_id, _ in username_index.prefix(prefix, limit + 1))
+
+    return [{'id': user_id, 'username': username} for user_id, username in list(ranked.items())[:limit]]
@@ -0,0 +1,97 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from . import cards
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+_executor = ThreadPoolExecutor(max_workers=settings.AVATAR_THUMBNAIL_WORKERS, thread_name_prefix='avatar-thumbs')
+
+
+class AvatarSizeLimitUploadHandler(FileUploadHandler):
+    """
+    Stops reading the multipart body once a file grows past
+    AVATAR_MAX_UPLOAD_SIZE; the view checks `exceeded` and answers 413.
+    """
+    exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.AVATAR_MAX_UPLOAD_SIZE:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def store_avatar(profile, upload):
+    """
+    Point profile.avatar at the upload, stored as avatars/<sha256>.<ext>.
+    Identical uploads share one file on disk. Call queue_thumbnails()
+    after saving the profile.
+    """
+    with Image.open(upload) as image:
+        extension = FORMAT_EXTENSIONS.get(image.format, 'img')
+    upload.seek(0)
+
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+
+    name = f'avatars/{digest.hexdigest()[:32]}.{extension}'
+    if not default_storage.exists(name):
+        default_storage.save(name, upload)
+
+    profile.avatar.name = name
+    profile.avatar_thumbnails = {}
+
+
+def queue_thumbnails(profile):
+    """Render thumbnails in the worker pool once the new avatar is committed."""
+    transaction.on_commit(lambda: _executor.submit(generate_thumbnails, profile.id, profile.avatar.name))
+
+
+def thumbnail_name(name, size):
+    stem = name.rsplit('.', 1)[0]
+    return f'{stem}_{size}.webp'
+
+
+def generate_thumbnails(profile_id, name):
+    """Worker: write square WebP thumbnails for every AVATAR_THUMBNAIL_SIZES entry."""
+    from .models import Profile
+
+    close_old_connections()
+    try:
+        with default_storage.open(name) as source, Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            thumbnails = {}
+            for size in settings.AVATAR_THUMBNAIL_SIZES:
+                thumb_name = thumbnail_name(name, size)
+                if not default_storage.exists(thumb_name):
+                    buffer = io.BytesIO()
+                    ImageOps.fit(image, (size, size), Image.LANCZOS).save(buffer, 'WEBP', quality=80, method=4)
+                    default_storage.save(thumb_name, ContentFile(buffer.getvalue()))
+                thumbnails[str(size)] = thumb_name
+
+        # Skip if the user uploaded another avatar in the meantime
+        updated = Profile.objects.filter(id=profile_id, avatar=name).update(avatar_thumbnails=thumbnails)
+        if updated:
+            user_id = Profile.objects.filter(id=profile_id).values_list('user_id', flat=True).first()
+            cards.invalidate_cards(user_id)
+    except Exception as e:
+        logger.error(f"Thumbnail generation failed for {name}: {str(e)}")
+    finally:
+        close_old_connections()
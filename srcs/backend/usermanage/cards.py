@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+# Bump when the card shape changes so stale entries are never read back.
+CARD_VERSION = 2
+
+def card_cache_key(user_id):
+    return f'user_card:v{CARD_VERSION}:{user_id}'
+
+def build_card(user):
+    profile = getattr(user, 'profile', None)
+    if profile is None:
+        avatar, thumbnails = None, {}
+    else:
+        avatar = profile.avatar.url if profile.avatar else profile.avatar_url
+        thumbnails = profile.avatar_thumbnails or {}
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'avatar': avatar,
+        'avatar_thumbnails': {int(size): default_storage.url(name) for size, name in thumbnails.items()},
+    }
+
+def card_avatar(card, size):
+    """Smallest thumbnail at least `size` px wide, else the original avatar."""
+    thumbnails = card.get('avatar_thumbnails') or {}
+    fitting = [thumb_size for thumb_size in thumbnails if int(thumb_size) >= size]
+    if fitting:
+        return thumbnails[min(fitting, key=int)]
+    return card['avatar']
+
+def get_cards(user_ids):
+    """
+    Return {user_id: card} with one cache multi-get; misses are loaded in
+    one query and written back.
+    """
+    keys = {card_cache_key(user_id): user_id for user_id in user_ids}
+    cards = {keys[key]: card for key, card in cache.get_many(keys).items()}
+    missing = [user_id for user_id in keys.values() if user_id not in cards]
+    if missing:
+        fresh = {user.id: build_card(user) for user in User.objects.filter(id__in=missing).select_related('profile')}
+        cache.set_many({card_cache_key(user_id): card for user_id, card in fresh.items()}, settings.USER_CARD_CACHE_TIMEOUT)
+        cards.update(fresh)
+    return cards
+
+def get_card(user_id):
+    return get_cards([user_id]).get(user_id)
+
+def invalidate_cards(*user_ids):
+    keys = [card_cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
\ No newline at end of file
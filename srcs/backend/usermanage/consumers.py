@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from backend.redis_client import get_async_redis
+from core.throttling import RateLimitedWebsocketConsumer
+from . import presence
+from .friends import get_friend_ids
+
+logger = logging.getLogger(__name__)
+
+# Users whose last announced state was "online": drops duplicate deltas, and
+# is what the connect-time snapshot reads, so snapshot and deltas agree.
+ANNOUNCED_KEY = 'presence:announced'
+# Held by whichever process runs the stale-announcement sweep this round.
+SWEEP_LOCK_KEY = 'presence:sweep'
+
+# Offline announcements waiting out the grace period; kept so they aren't
+# garbage-collected before they run.
+_grace_tasks = set()
+
+
+def presence_group(user_id):
+    return f'presence_inbox_{user_id}'
+
+
+def user_group(user_id):
+    """Every ws/gateway/ socket of one user; used for chat messages addressed to them."""
+    return f'user_{user_id}'
+
+
+def connections_key(user_id):
+    # Sorted set of a user's open presence sockets across all processes:
+    # channel name -> expiry time. The keepalive pushes the expiry forward,
+    # so sockets of a crashed worker stop counting after PRESENCE_ONLINE_WINDOW.
+    return f'presence:connections:{user_id}'
+
+
+async def refresh_connection(user_id, channel_name):
+    """Add or renew one open socket; returns how many the user has open."""
+    key = connections_key(user_id)
+    now = time.time()
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.zremrangebyscore(key, '-inf', now)
+    pipe.zadd(key, {channel_name: now + settings.PRESENCE_ONLINE_WINDOW})
+    pipe.expire(key, settings.PRESENCE_ONLINE_WINDOW)
+    pipe.zcard(key)
+    return (await pipe.execute())[-1]
+
+
+async def remove_connection(user_id, channel_name):
+    """Forget one socket; returns how many the user still has open."""
+    key = connections_key(user_id)
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.zrem(key, channel_name)
+    pipe.zremrangebyscore(key, '-inf', time.time())
+    pipe.zcard(key)
+    return (await pipe.execute())[-1]
+
+
+async def announce(user_id, online):
+    """Push a state change for user_id to every friend's presence socket."""
+    redis = get_async_redis()
+    if online:
+        changed = await redis.sadd(ANNOUNCED_KEY, user_id)
+    else:
+        changed = await redis.srem(ANNOUNCED_KEY, user_id)
+    if not changed:
+        return
+    channel_layer = get_channel_layer()
+    friend_ids = await database_sync_to_async(get_friend_ids)(user_id)
+    event = {"type": "presence_delta", "user_id": user_id, "online": online}
+    for friend_id in friend_ids:
+        await channel_layer.group_send(presence_group(friend_id), event)
+
+
+async def announced_states(user_ids):
+    """{user_id: online} as last announced to friends."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    flags = await get_async_redis().smismember(ANNOUNCED_KEY, user_ids)
+    return {user_id: bool(flag) for user_id, flag in zip(user_ids, flags)}
+
+
+async def sweep_stale_announcements():
+    """
+    Announce offline users still marked online whose sockets all expired
+    (their worker died without running disconnect). At most one process
+    sweeps per PRESENCE_ONLINE_WINDOW / 2.
+    """
+    redis = get_async_redis()
+    interval = settings.PRESENCE_ONLINE_WINDOW / 2
+    if not await redis.set(SWEEP_LOCK_KEY, 1, nx=True, ex=int(interval)):
+        return
+    now = time.time()
+    async for member in redis.sscan_iter(ANNOUNCED_KEY):
+        user_id = int(member)
+        if not await redis.zcount(connections_key(user_id), now, '+inf'):
+            logger.info(f"Presence: sockets of user {user_id} expired, announcing offline")
+            await announce(user_id, False)
+
+
+async def announce_offline_after_grace(user_id):
+    # Reconnects within the grace period never reach friends as offline/online pairs
+    await asyncio.sleep(settings.PRESENCE_OFFLINE_GRACE)
+    if not await get_async_redis().zcount(connections_key(user_id), time.time(), '+inf'):
+        await announce(user_id, False)
+
+
+class PresenceConsumer(RateLimitedWebsocketConsumer):
+    """
+    Streams friends' online/offline changes as
+    {"type": "presence", "online": [ids], "offline": [ids]}.
+    The first message is a snapshot of every friend; later ones are deltas,
+    coalesced over PRESENCE_PUSH_INTERVAL seconds.
+    """
+    rate_limit_scope = 'presence'
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close(code=4001)
+            return
+        self.user_id = user.id
+        self.pending = {}
+        self.sent = {}
+        self.tasks = []
+
+        await self.accept()
+        await self.channel_layer.group_add(presence_group(self.user_id), self.channel_name)
+
+        friend_ids = await database_sync_to_async(get_friend_ids)(self.user_id)
+        snapshot = await announced_states(friend_ids)
+        self.sent.update(snapshot)
+        await self.send_states(snapshot)
+
+        presence.touch(self.user_id)
+        count = await refresh_connection(self.user_id, self.channel_name)
+        if count == 1:
+            await announce(self.user_id, True)
+
+        self.tasks = [
+            asyncio.create_task(self.push_loop()),
+            asyncio.create_task(self.keepalive_loop()),
+        ]
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'user_id'):
+            return
+        for task in self.tasks:
+            task.cancel()
+        await self.channel_layer.group_discard(presence_group(self.user_id), self.channel_name)
+        if not await remove_connection(self.user_id, self.channel_name):
+            task = asyncio.create_task(announce_offline_after_grace(self.user_id))
+            _grace_tasks.add(task)
+            task.add_done_callback(_grace_tasks.discard)
+
+    async def presence_delta(self, event):
+        self.pending[event["user_id"]] = event["online"]
+
+    async def push_loop(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_PUSH_INTERVAL)
+            changes = {user_id: online for user_id, online in self.pending.items()
+                       if self.sent.get(user_id) != online}
+            self.pending.clear()
+            if changes:
+                self.sent.update(changes)
+                await self.send_states(changes)
+
+    async def keepalive_loop(self):
+        # An open socket keeps the user inside the online window
+        while True:
+            await asyncio.sleep(settings.PRESENCE_ONLINE_WINDOW / 2)
+            presence.touch(self.user_id)
+            await refresh_connection(self.user_id, self.channel_name)
+            await sweep_stale_announcements()
+
+    async def send_states(self, states):
+        await self.send(text_data=json.dumps({
+            "type": "presence",
+            "online": [user_id for user_id, online in states.items() if online],
+            "offline": [user_id for user_id, online in states.items() if not online],
+        }))
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Friendships live in Friendship, one row per pair ordered (lower id, higher
+# id). FriendRequest keeps the request workflow; accepting or deleting an
+# accepted request adds or removes the edge (see models.py).
+
+def pair(user_id, other_id):
+    return min(user_id, other_id), max(user_id, other_id)
+
+def friend_ids_cache_key(user_id):
+    return f'friends:{user_id}'
+
+def friendship_cache_key(user_id, other_id):
+    return 'friendship:{}:{}'.format(*pair(user_id, other_id))
+
+def get_friend_ids(user_id):
+    """Ids of every friend of user_id."""
+    key = friend_ids_cache_key(user_id)
+    friend_ids = cache.get(key)
+    if friend_ids is None:
+        from .models import Friendship
+        higher = Friendship.objects.filter(user_low_id=user_id).values_list('user_high_id', flat=True)
+        lower = Friendship.objects.filter(user_high_id=user_id).values_list('user_low_id', flat=True)
+        friend_ids = set(higher) | set(lower)
+        cache.set(key, friend_ids, settings.FRIENDS_CACHE_TIMEOUT)
+    return friend_ids
+
+def are_friends(user_id, other_id):
+    """A cache hit, or a single probe of the (user_low, user_high) unique index."""
+    if user_id == other_id:
+        return False
+    friend_ids = cache.get(friend_ids_cache_key(user_id))
+    if friend_ids is not None:
+        return other_id in friend_ids
+    key = friendship_cache_key(user_id, other_id)
+    result = cache.get(key)
+    if result is None:
+        from .models import Friendship
+        low, high = pair(user_id, other_id)
+        result = Friendship.objects.filter(user_low_id=low, user_high_id=high).exists()
+        cache.set(key, result, settings.FRIENDS_CACHE_TIMEOUT)
+    return result
+
+def add_friendship(user_id, other_id):
+    from .models import Friendship
+    low, high = pair(user_id, other_id)
+    Friendship.objects.bulk_create([Friendship(user_low_id=low, user_high_id=high)], ignore_conflicts=True)
+    invalidate_friendship(user_id, other_id)
+
+def remove_friendship(user_id, other_id):
+    """Unfriend: drops the edge and the accepted requests behind it. Returns whether they were friends."""
+    from .models import FriendRequest, Friendship
+    low, high = pair(user_id, other_id)
+    with transaction.atomic():
+        deleted, _ = Friendship.objects.filter(user_low_id=low, user_high_id=high).delete()
+        FriendRequest.objects.filter(sender_id__in=(low, high), receiver_id__in=(low, high), status="accepted").delete()
+    invalidate_friendship(user_id, other_id)
+    return deleted > 0
+
+def invalidate_friend_ids(*user_ids):
+    keys = [friend_ids_cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+def invalidate_friendship(user_id, other_id):
+    keys = [friend_ids_cache_key(user_id), friend_ids_cache_key(other_id), friendship_cache_key(user_id, other_id)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+logger = logging.getLogger(__name__)
+
+
+class HashingOverloaded(Exception):
+    """More password hashes are queued than PASSWORD_HASH_MAX_PENDING; answer 503."""
+
+
+class HashingPool:
+    """
+    Runs password hashing on a fixed number of threads (hashlib releases the
+    GIL, so they hash in parallel) and refuses new work once too much is
+    queued, so a burst of logins can't take every CPU from other requests.
+    Identical requests already in flight (double submits, client retries)
+    share one hash.
+    """
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.pending = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.shed = 0
+
+    def run(self, key, fn, *args):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                if self.pending >= self.max_pending:
+                    self.shed += 1
+                    logger.warning(f"Password hashing overloaded ({self.pending} pending), shedding request")
+                    raise HashingOverloaded()
+                self.pending += 1
+                future = self._executor.submit(fn, *args)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f: self._done(key))
+        return future.result()
+
+    def _done(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'coalesced': self.coalesced,
+                'shed': self.shed,
+            }
+
+
+pool = HashingPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_PENDING)
+
+
+def _key(*parts):
+    # Keyed digest so raw passwords are never held as dict keys
+    return hmac.new(settings.SECRET_KEY.encode(), '\0'.join(parts).encode(), hashlib.sha256).hexdigest()
+
+
+def _verify(password, encoded):
+    needs_rehash = []
+    valid = hashers.check_password(password, encoded, setter=lambda raw: needs_rehash.append(True))
+    return valid, bool(needs_rehash)
+
+
+def make_password(password):
+    """hashers.make_password, run on the pool. Every call gets a fresh salt, so nothing is coalesced."""
+    return pool.run(object(), hashers.make_password, password)
+
+
+def check_password(password, encoded):
+    """
+    Returns (valid, needs_rehash). With no encoded password (unknown user)
+    a throwaway hash is still computed so the response takes as long.
+    """
+    if encoded is None:
+        make_password(password)
+        return False, False
+    return pool.run(_key('check', password, encoded), _verify, password, encoded)
@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from rest_framework.test import APIRequestFactory
+
+from usermanage import hashing
+from usermanage.views import LoginView
+
+
+class Command(BaseCommand):
+    help = "Hammer LoginView from several threads and report logins/sec per core and hashing pool stats"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--concurrency', type=int, default=(os.cpu_count() or 1) * 4)
+
+    def handle(self, *args, **options):
+        username = f'bench_{uuid.uuid4().hex[:12]}'
+        password = uuid.uuid4().hex
+        user = User.objects.create_user(username=username, email=f'{username}@bench.invalid', password=password)
+        view = LoginView.as_view()
+        factory = APIRequestFactory()
+        statuses = Counter()
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def worker(n):
+            # A different password per thread so concurrent requests aren't coalesced;
+            # a failed check costs the same hash as a successful one
+            body = {'username': username, 'password': password if n == 0 else f'{password}-{n}'}
+            counts = Counter()
+            while time.monotonic() < deadline:
+                counts[view(factory.post('/login/', body, format='json')).status_code] += 1
+            with lock:
+                statuses.update(counts)
+            close_old_connections()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['concurrency'])]
+        started = time.monotonic()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            user.delete()
+        elapsed = time.monotonic() - started
+
+        cores = os.cpu_count() or 1
+        answered = statuses[200] + statuses[400]
+        self.stdout.write(f"{answered} logins in {elapsed:.1f}s with {options['concurrency']} clients: "
+                          f"{answered / elapsed:.1f}/s, {answered / elapsed / cores:.1f}/s per core ({cores} cores)")
+        self.stdout.write(f"responses: {dict(statuses)}")
+        self.stdout.write(f"hashing pool: {hashing.pool.stats()}")
@@ -0,0 +1,81 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Serve fake 42 API /oauth/token and /v2/me endpoints for load testing the OAuth callback (set FT_API_URL to point at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8042)
+        parser.add_argument('--delay', type=float, default=0.1, help="Seconds to wait before answering, like the real API's latency")
+        parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests answered with 503 + Retry-After")
+
+    def handle(self, *args, **options):
+        delay = options['delay']
+        fail_rate = options['fail_rate']
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def send_json(self, status, payload, headers=()):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def maybe_fail(self):
+                time.sleep(delay)
+                if random.random() < fail_rate:
+                    self.send_json(503, {'error': 'unavailable'}, [('Retry-After', '1')])
+                    return True
+                return False
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = parse_qs(self.rfile.read(length).decode())
+                if self.path != '/oauth/token':
+                    return self.send_json(404, {'error': 'not found'})
+                if self.maybe_fail():
+                    return
+                code = form.get('code', [''])[0]
+                if not code:
+                    return self.send_json(401, {'error': 'invalid_grant'})
+                self.send_json(200, {'access_token': f'stub-{code}', 'token_type': 'bearer', 'expires_in': 7200})
+
+            def do_GET(self):
+                if self.path != '/v2/me':
+                    return self.send_json(404, {'error': 'not found'})
+                if self.maybe_fail():
+                    return
+                token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+                if not token.startswith('stub-'):
+                    return self.send_json(401, {'error': 'unauthorized'})
+                login = f"stub_{token[len('stub-'):]}"[:150]
+                self.send_json(200, {
+                    'login': login,
+                    'email': f'{login}@student.42.fr',
+                    'first_name': 'Stub',
+                    'last_name': 'User',
+                    'image': {'link': None},
+                })
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(f"42 API stub listening on http://127.0.0.1:{options['port']} (delay={delay}s, fail-rate={fail_rate})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,248 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import timezone
+
+from chat import unread
+from chat.models import ChatMessage, conversation_key
+from core.models import MatchHistory, NumberTapMatch
+from usermanage import cards, friends
+from usermanage.middleware import identity_cache_key
+from usermanage.models import FriendRequest, Friendship, Profile, PROFILE_USER_FIELDS
+
+WORDS = ("gg wp lol nice shot rematch? ready when you are one more game brb "
+         "that was close pong tap tournament tonight who's in see you later").split()
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the timestamps we generate instead of auto_now_add's now()."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ("Generate a reproducible synthetic dataset (users, friendships, chat messages, match histories) "
+            "with bulk inserts, for benchmarking. The same --seed always gives the same data.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--friends', type=int, default=20, help="Average friendships per user")
+        parser.add_argument('--messages', type=int, default=50000)
+        parser.add_argument('--matches', type=int, default=10000, help="Rows of each of MatchHistory and NumberTapMatch")
+        parser.add_argument('--days', type=int, default=90, help="Spread timestamps over this many past days")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='seed_', help="Username prefix marking generated users")
+        parser.add_argument('--password', default='password123', help="Password shared by every generated user")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--flush', action='store_true', help="Delete previously generated users (and their rows) first")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.span = timedelta(days=options['days']).total_seconds()
+        prefix = options['prefix']
+
+        stale_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        if stale_ids:
+            if not options['flush']:
+                raise CommandError(f"Users starting with '{prefix}' already exist; pass --flush to replace them")
+            started = time.monotonic()
+            count = self.flush(stale_ids)
+            self.stdout.write(f"Deleted {count} rows from a previous run in {time.monotonic() - started:.1f}s")
+
+        with transaction.atomic():
+            users = self.timed('users', self.create_users, prefix, options['users'], options['password'])
+            pairs = self.timed('accepted friendships', self.create_friend_requests, users, options['friends'])
+            self.timed('chat messages', self.create_messages, users, pairs, options['messages'])
+            self.timed('match histories', self.create_match_histories, users, options['matches'])
+            self.timed('number tap matches', self.create_number_tap_matches, users, options['matches'])
+
+            # No signals fired for the deleted or the new users; drop anything cached under their ids
+            user_ids = stale_ids + [user.id for user in users]
+            for i in range(0, len(user_ids), self.batch_size):
+                batch = user_ids[i:i + self.batch_size]
+                cards.invalidate_cards(*batch)
+                friends.invalidate_friend_ids(*batch)
+                unread.invalidate(*batch)
+                cache.delete_many([identity_cache_key(user_id) for user_id in batch])
+
+        self.stdout.write("Running processes pick up the new usernames for autocomplete after a restart.")
+
+    def flush(self, user_ids):
+        """
+        Delete the users and every row pointing at them with raw DELETEs, a
+        batch of users at a time. QuerySet.delete() would collect the whole
+        cascade in memory and fire the per-row signals (friendship removal,
+        username index, ...) for every message and request; handle() clears
+        the caches those would have touched once, at the end. Returns rows deleted.
+        """
+        # Hidden relations too: Friendship's related_name='+' and the auth M2M tables
+        dependents = [field for field in User._meta.get_fields(include_hidden=True)
+                      if field.auto_created and not field.concrete and (field.one_to_many or field.one_to_one)]
+        deleted = 0
+        with transaction.atomic():
+            for i in range(0, len(user_ids), self.batch_size):
+                batch = user_ids[i:i + self.batch_size]
+                for rel in dependents:
+                    rows = rel.related_model._base_manager.filter(**{f'{rel.field.name}__in': batch})
+                    if rel.on_delete is models.SET_NULL:
+                        rows.update(**{rel.field.name: None})
+                    else:
+                        deleted += rows._raw_delete(rows.db)
+                users = User._base_manager.filter(id__in=batch)
+                deleted += users._raw_delete(users.db)
+        return deleted
+
+    def timed(self, label, fn, *args):
+        started = time.monotonic()
+        result = fn(*args)
+        count = len(result) if hasattr(result, '__len__') else result
+        self.stdout.write(f"{count} {label} in {time.monotonic() - started:.1f}s")
+        return result
+
+    def timestamp(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.span)
+
+    def bulk_create(self, model, objs):
+        return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def create_users(self, prefix, count, password):
+        # Hash once: every user shares the password, and PBKDF2 per row would dominate the run
+        hashed = make_password(password)
+        users = []
+        for i in range(count):
+            username = f'{prefix}{i:06d}'
+            users.append(User(
+                username=username,
+                email=f'{username}@seed.invalid',
+                password=hashed,
+                first_name=self.rng.choice(('Amine', 'Sara', 'Youssef', 'Lina', 'Omar', 'Nora', 'Adam', 'Imane')),
+                last_name=self.rng.choice(('Alaoui', 'Bennani', 'Tazi', 'Idrissi', 'Fassi', 'Berrada')),
+                date_joined=self.timestamp(),
+            ))
+        self.bulk_create(User, users)
+        if users and users[0].pk is None:
+            # Backends that can't return ids from bulk inserts
+            ids = dict(User.objects.filter(username__startswith=prefix).values_list('username', 'id'))
+            for user in users:
+                user.id = ids[user.username]
+
+        # What the User post_save receiver would have created
+        with explicit_timestamps(Profile._meta.get_field('created_at')):
+            self.bulk_create(Profile, [
+                Profile(user=user, created_at=user.date_joined, last_activity=user.date_joined,
+                        **{field: getattr(user, field) for field in PROFILE_USER_FIELDS})
+                for user in users
+            ])
+        return users
+
+    def create_friend_requests(self, users, average):
+        """Returns the accepted (low id, high id) pairs; about 10% of requests stay pending."""
+        if len(users) < 2 or average <= 0:
+            return []
+        seen = set()
+        requests = []
+        accepted = []
+        for user in users:
+            for _ in range(min(len(users) - 1, int(self.rng.expovariate(2 / average)))):
+                other = self.rng.choice(users)
+                pair = (min(user.id, other.id), max(user.id, other.id))
+                if other.id == user.id or pair in seen:
+                    continue
+                seen.add(pair)
+                status = 'pending' if self.rng.random() < 0.1 else 'accepted'
+                requests.append(FriendRequest(sender=user, receiver=other, status=status, timestamp=self.timestamp()))
+                if status == 'accepted':
+                    accepted.append(pair)
+        with explicit_timestamps(FriendRequest._meta.get_field('timestamp')):
+            self.bulk_create(FriendRequest, requests)
+        # What the FriendRequest post_save receiver would have created
+        self.bulk_create(Friendship, [Friendship(user_low_id=low, user_high_id=high) for low, high in accepted])
+        self.stdout.write(f"{len(requests)} friend requests")
+        return accepted
+
+    def create_messages(self, users, pairs, count):
+        """Mostly between friends, in conversations of a few messages, oldest read."""
+        if len(users) < 2:
+            return 0
+        read_before = self.now - timedelta(days=1)
+        created = 0
+        while created < count:
+            batch = []
+            while len(batch) < self.batch_size and created + len(batch) < count:
+                if pairs and self.rng.random() < 0.8:
+                    a, b = self.rng.choice(pairs)
+                else:
+                    a, b = (user.id for user in self.rng.sample(users, 2))
+                started = self.timestamp()
+                for n in range(min(self.rng.randint(1, 8), count - created - len(batch))):
+                    sender, receiver = (a, b) if self.rng.random() < 0.5 else (b, a)
+                    timestamp = started + timedelta(seconds=n * self.rng.randint(5, 120))
+                    batch.append(ChatMessage(
+                        sender_id=sender,
+                        receiver_id=receiver,
+                        conversation=conversation_key(sender, receiver),
+                        message=' '.join(self.rng.choices(WORDS, k=self.rng.randint(1, 12))),
+                        timestamp=timestamp,
+                        is_read=timestamp < read_before,
+                    ))
+            ChatMessage.objects.bulk_create(batch)
+            created += len(batch)
+        return created
+
+    def create_match_histories(self, users, count):
+        matches = []
+        with explicit_timestamps(MatchHistory._meta.get_field('created_at')):
+            for _ in range(count):
+                user = self.rng.choice(users)
+                opponent = f'guest{self.rng.randint(1, 99)}'
+                score1, score2 = self.scores(5)
+                matches.append(MatchHistory(
+                    user=user,
+                    player1_username=user.username,
+                    player2_username=opponent,
+                    score1=score1,
+                    score2=score2,
+                    result=user.username if score1 > score2 else opponent,
+                    created_at=self.timestamp(),
+                ))
+            self.bulk_create(MatchHistory, matches)
+        return matches
+
+    def create_number_tap_matches(self, users, count):
+        if len(users) < 2:
+            return []
+        matches = []
+        with explicit_timestamps(NumberTapMatch._meta.get_field('created_at')):
+            for _ in range(count):
+                player1, player2 = self.rng.sample(users, 2)
+                score1, score2 = self.scores(self.rng.randint(10, 30))
+                # bulk_create skips NumberTapMatch.save(), which picks the winner
+                matches.append(NumberTapMatch(
+                    player1=player1,
+                    player2=player2,
+                    player1_score=score1,
+                    player2_score=score2,
+                    winner=player1 if score1 > score2 else player2,
+                    created_at=self.timestamp(),
+                ))
+            self.bulk_create(NumberTapMatch, matches)
+        return matches
+
+    def scores(self, target):
+        loser = self.rng.randint(0, target - 1)
+        return (target, loser) if self.rng.random() < 0.5 else (loser, target)
@@ -1,4 +1,17 @@
 import logging
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework_simplejwt.tokens import AccessToken, TokenError
+
+from . import presence
 
 logger = logging.getLogger(__name__)
 
@@ -9,7 +22,108 @@ class UpdateLastActivityMiddleware:
     def __call__(self, request):
         response = self.get_response(request)
         if request.user.is_authenticated:
-            profile = request.user.profile
-            old_last_activity = profile.last_activity
-            profile.update_activity()
-        return response
\ No newline at end of file
+            presence.touch(request.user.id)
+        return response
+
+
+class TokenUserCache:
+    """
+    Bounded LRU cache of access token -> user id, so websocket reconnects
+    don't decode and verify the JWT again. Entries never outlive the
+    token's own `exp` claim. The user behind the id comes from the shared
+    identity cache below, not from this process.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, token):
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        user_id, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return user_id
+
+    def set(self, token, user_id, token_exp):
+        lifetime = min(self.ttl, token_exp - time.time())
+        if lifetime <= 0:
+            return
+        self._entries[token] = (user_id, time.monotonic() + lifetime)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+token_cache = TokenUserCache(
+    maxsize=settings.WS_TOKEN_CACHE_SIZE,
+    ttl=settings.WS_TOKEN_CACHE_TTL,
+)
+
+def identity_cache_key(user_id):
+    return f'ws_identity:{user_id}'
+
+def invalidate_identity(user_id):
+    """Called on User save/delete, so renames and deactivations apply at the next handshake."""
+    cache.delete(identity_cache_key(user_id))
+
+@database_sync_to_async
+def _load_identity(user_id):
+    return get_user_model().objects.filter(id=user_id).values_list('username', 'is_active').first()
+
+async def _get_active_user(user_id):
+    """
+    An unsaved User carrying id and username, from a (username, is_active)
+    pair cached for WS_TOKEN_CACHE_TTL, so reconnect storms stay off the
+    database. None if the user is gone or inactive.
+    """
+    key = identity_cache_key(user_id)
+    identity = await cache.aget(key)
+    if identity is None:
+        identity = await _load_identity(user_id)
+        if identity is None:
+            return None
+        await cache.aset(key, identity, settings.WS_TOKEN_CACHE_TTL)
+    username, is_active = identity
+    if not is_active:
+        return None
+    return get_user_model()(id=user_id, username=username, is_active=True)
+
+async def get_user_for_token(token):
+    """Return the user owning a valid access token, or None."""
+    if not token:
+        return None
+    user_id = token_cache.get(token)
+    if user_id is None:
+        try:
+            access_token = AccessToken(token)
+        except TokenError as e:
+            logger.error(f"Token validation failed: {str(e)}")
+            return None
+        user_id = access_token['user_id']
+        token_cache.set(token, user_id, access_token['exp'])
+    user = await _get_active_user(user_id)
+    if user is None:
+        logger.error(f"Token validation failed: user {user_id} not found or inactive")
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populates scope['user'] from a `?token=<access token>` query parameter
+    during the websocket handshake.
+    """
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token', [None])[0]
+        user = await get_user_for_token(token)
+        scope['user'] = user or AnonymousUser()
+        return await super().__call__(scope, receive, send)
\ No newline at end of file
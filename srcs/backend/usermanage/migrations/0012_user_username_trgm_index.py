@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-19 09:12
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('usermanage', '0011_profile_is_online_profile_last_activity'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Matches the UPPER(username::text) LIKE UPPER(...) that icontains
+        # generates, so ?filter[search]= on /users/ uses the index.
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS usermanage_user_username_trgm '
+            'ON auth_user USING gin (UPPER(username::text) gin_trgm_ops);',
+            'DROP INDEX CONCURRENTLY IF EXISTS usermanage_user_username_trgm;',
+        ),
+    ]
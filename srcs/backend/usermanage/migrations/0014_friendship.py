@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-19 20:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_friendships(apps, schema_editor):
+    """One edge per pair with an accepted request, whichever direction(s) it went."""
+    FriendRequest = apps.get_model('usermanage', 'FriendRequest')
+    Friendship = apps.get_model('usermanage', 'Friendship')
+    pairs = {
+        (min(sender_id, receiver_id), max(sender_id, receiver_id))
+        for sender_id, receiver_id in FriendRequest.objects.filter(status='accepted')
+        .values_list('sender_id', 'receiver_id').iterator(chunk_size=5000)
+        if sender_id != receiver_id
+    }
+    Friendship.objects.bulk_create([Friendship(user_low_id=low, user_high_id=high) for low, high in pairs],
+                                   batch_size=5000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('usermanage', '0013_profile_avatar_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['user_high', 'user_low'], name='friendship_high_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.CheckConstraint(check=models.Q(('user_low__lt', models.F('user_high'))), name='friendship_ordered_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='friendship_unique_pair'),
+        ),
+        migrations.RunPython(backfill_friendships, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 import logging
+from . import presence, friends
 
 logger = logging.getLogger(__name__)
 
@@ -18,39 +19,36 @@ class Profile(models.Model):
     last_name = models.CharField(max_length=255,null=True)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     avatar_url = models.URLField(max_length=500, blank=True, default=DEFAULT_AVATAR_URL)
+    avatar_thumbnails = models.JSONField(default=dict, blank=True)  # {"<size>": storage name}, see avatars.py
     created_at = models.DateTimeField(auto_now_add=True)
     last_activity = models.DateTimeField(default=timezone.now)
     is_online = models.BooleanField(default=False)
     #addthis
     def update_activity(self):
+        # Written to the DB in batches by presence.flush()
         self.last_activity = timezone.now()
-        self.save(update_fields=['last_activity'])  # Ensure this commits
-        # Verify in DB
-        updated_profile = Profile.objects.get(id=self.id)
+        presence.touch(self.user_id)
     #addthis
     @property
     def online_status(self):
-        time_threshold = timezone.now() - timezone.timedelta(minutes=5)
-        is_online = self.last_activity >= time_threshold
-        logger.info(f"Calculating online_status for {self.user.username}: last_activity={self.last_activity}, now={timezone.now()}, threshold={time_threshold}, result={is_online}")
-        return is_online
+        return presence.is_online(self.user_id)
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        profile = Profile.objects.create(user=instance)
-        profile.email = instance.email
-        profile.first_name = instance.first_name
-        profile.last_name = instance.last_name
-        profile.save()
+PROFILE_USER_FIELDS = ('email', 'first_name', 'last_name')
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def sync_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        Profile.objects.create(user=instance, **{field: getattr(instance, field) for field in PROFILE_USER_FIELDS})
+        return
+    # e.g. last_login or password updates don't touch the copied fields
+    if update_fields is not None and not set(update_fields) & set(PROFILE_USER_FIELDS):
+        return
     profile = instance.profile
-    profile.email = instance.email
-    profile.first_name = instance.first_name
-    profile.last_name = instance.last_name
-    profile.save()
+    changed = [field for field in PROFILE_USER_FIELDS if getattr(profile, field) != getattr(instance, field)]
+    if changed:
+        for field in changed:
+            setattr(profile, field, getattr(instance, field))
+        profile.save(update_fields=changed)
 
 class FriendRequest(models.Model):
     STATUS_CHOICES = (
@@ -70,4 +68,56 @@ class FriendRequest(models.Model):
     def __str__(self):
         return f"{self.sender.username} -> {self.receiver.username} ({self.status})"
 
+class Friendship(models.Model):
+    """One row per pair of friends, stored once with the lower user id first (see friends.pair)."""
+    user_low = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(user_low__lt=models.F('user_high')), name='friendship_ordered_pair'),
+            # Also serves lookups by user_low
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='friendship_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['user_high', 'user_low'], name='friendship_high_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_low_id} <-> {self.user_high_id}"
+
+@receiver(post_save, sender=FriendRequest)
+def add_friendship(sender, instance, **kwargs):
+    if instance.status == "accepted":
+        friends.add_friendship(instance.sender_id, instance.receiver_id)
+
+@receiver(post_delete, sender=FriendRequest)
+def remove_friendship(sender, instance, **kwargs):
+    if instance.status != "accepted":
+        return
+    # Both may have sent a request the other accepted; either keeps them friends
+    if FriendRequest.objects.filter(sender_id=instance.receiver_id, receiver_id=instance.sender_id, status="accepted").exists():
+        return
+    low, high = friends.pair(instance.sender_id, instance.receiver_id)
+    Friendship.objects.filter(user_low_id=low, user_high_id=high).delete()
+    friends.invalidate_friendship(low, high)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_ws_identity(sender, instance, **kwargs):
+    from .middleware import invalidate_identity
+    invalidate_identity(instance.id)
+
+@receiver(post_save, sender=User)
+def index_username(sender, instance, **kwargs):
+    from .autocomplete import username_index
+    if instance.is_active:
+        username_index.add(instance.id, instance.username)
+    else:
+        username_index.remove(instance.id)
 
+@receiver(post_delete, sender=User)
+def unindex_username(sender, instance, **kwargs):
+    from .autocomplete import username_index
+    username_index.remove(instance.id)
\ No newline at end of file
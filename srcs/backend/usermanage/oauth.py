@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import random
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+# The API refused these before doing any work, so even the code exchange can retry
+REJECTED_STATUSES = {429, 503}
+
+_clients = {}
+
+
+def get_client():
+    """
+    One pooled AsyncClient per event loop, shared by every OAuth request so
+    logins reuse TLS connections to the 42 API.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        config = settings.FT_OAUTH
+        client = httpx.AsyncClient(
+            base_url=config['API_URL'],
+            timeout=httpx.Timeout(config['TIMEOUT'], connect=config['CONNECT_TIMEOUT']),
+            limits=httpx.Limits(max_connections=config['MAX_CONNECTIONS'], max_keepalive_connections=config['MAX_CONNECTIONS']),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def request(method, url, idempotent=True, **kwargs):
+    """
+    Send a request, retrying with jittered exponential backoff. Requests
+    that are not idempotent (the single-use code exchange) are only retried
+    when nothing reached the API or it explicitly turned the request away.
+    """
+    retries = settings.FT_OAUTH['RETRIES']
+    for attempt in range(retries + 1):
+        delay = settings.FT_OAUTH['BACKOFF'] * (2 ** attempt) * (0.5 + random.random())
+        try:
+            response = await get_client().request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"42 API {method} {url} failed to connect ({e!r}), retrying in {delay:.2f}s")
+        except httpx.TransportError as e:
+            if not idempotent or attempt == retries:
+                raise
+            logger.warning(f"42 API {method} {url} failed ({e!r}), retrying in {delay:.2f}s")
+        else:
+            retryable = RETRY_STATUSES if idempotent else REJECTED_STATUSES
+            if response.status_code not in retryable or attempt == retries:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = min(int(retry_after), settings.FT_OAUTH['MAX_RETRY_AFTER'])
+            logger.warning(f"42 API {method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+# exchange_code() and fetch_me() raise ValueError for a 200 whose body isn't
+# JSON (a proxy's error page, say); callers treat it like an httpx error.
+
+async def exchange_code(code):
+    config = settings.FT_OAUTH
+    response = await request('POST', '/oauth/token', idempotent=False, data={
+        'grant_type': 'authorization_code',
+        'client_id': config['CLIENT_ID'],
+        'client_secret': config['CLIENT_SECRET'],
+        'code': code,
+        'redirect_uri': config['REDIRECT_URI'],
+    })
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    return data.get('access_token') if isinstance(data, dict) else None
+
+
+async def fetch_me(access_token):
+    response = await request('GET', '/v2/me', headers={'Authorization': f'Bearer {access_token}'})
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    return data if isinstance(data, dict) else None
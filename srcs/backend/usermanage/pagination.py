@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key, in JSON:API query-parameter style:
+    ?page[cursor]=...&page[size]=...
+    """
+    cursor_query_param = 'page[cursor]'
+    page_size_query_param = 'page[size]'
+    page_size = 50
+    max_page_size = 200
+    ordering = 'id'
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'links': {
+                'next': self.get_next_link(),
+                'prev': self.get_previous_link(),
+            },
+        })
\ No newline at end of file
@@ -0,0 +1,122 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Value, When
+
+from backend.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of user id -> unix timestamp of last activity.
+LAST_SEEN_KEY = 'presence:last_seen'
+
+_pending = {}
+_lock = threading.Lock()
+_flusher = None
+
+
+def touch(user_id):
+    """
+    Record activity for a user. This does no I/O: timestamps are coalesced
+    in memory and written out by the background flusher.
+    """
+    with _lock:
+        _pending[user_id] = time.time()
+    _ensure_flusher()
+
+
+def get_presence(user_ids):
+    """
+    Return {user_id: is_online} for many users in one Redis round-trip.
+    Users Redis has no record of fall back to a single Profile query.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    threshold = time.time() - settings.PRESENCE_ONLINE_WINDOW
+    with _lock:
+        last_seen = {user_id: _pending[user_id] for user_id in user_ids if user_id in _pending}
+
+    missing = [user_id for user_id in user_ids if user_id not in last_seen]
+    if missing:
+        try:
+            scores = get_redis().zmscore(LAST_SEEN_KEY, missing)
+        except redis.RedisError as e:
+            logger.error(f"Presence lookup in Redis failed: {str(e)}")
+            scores = [None] * len(missing)
+        last_seen.update((user_id, ts) for user_id, ts in zip(missing, scores) if ts is not None)
+
+    missing = [user_id for user_id in user_ids if user_id not in last_seen]
+    if missing:
+        from .models import Profile
+        for user_id, last_activity in Profile.objects.filter(user_id__in=missing).values_list('user_id', 'last_activity'):
+            last_seen[user_id] = last_activity.timestamp()
+
+    return {user_id: last_seen.get(user_id, 0) >= threshold for user_id in user_ids}
+
+
+def is_online(user_id):
+    return get_presence([user_id])[user_id]
+
+
+def flush():
+    """Write pending activity to Redis and Profile.last_activity."""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.zadd(LAST_SEEN_KEY, batch, gt=True)
+        pipe.zremrangebyscore(LAST_SEEN_KEY, '-inf', time.time() - settings.PRESENCE_RETENTION)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Presence flush to Redis failed: {str(e)}")
+
+    _write_last_activity(batch)
+    return len(batch)
+
+
+def _write_last_activity(batch):
+    from .models import Profile
+
+    items = list(batch.items())
+    size = settings.PRESENCE_FLUSH_BATCH_SIZE
+    for start in range(0, len(items), size):
+        chunk = items[start:start + size]
+        Profile.objects.filter(user_id__in=[user_id for user_id, _ in chunk]).update(
+            last_activity=Case(
+                *[When(user_id=user_id, then=Value(datetime.fromtimestamp(ts, tz=dt_timezone.utc)))
+                  for user_id, ts in chunk],
+                output_field=DateTimeField(),
+            )
+        )
+
+
+def _run_flusher():
+    while True:
+        time.sleep(settings.PRESENCE_FLUSH_INTERVAL)
+        close_old_connections()
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Presence flush failed: {str(e)}")
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name='presence-flusher', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
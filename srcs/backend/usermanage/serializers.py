@@ -1,7 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from django.contrib.auth import authenticate
+from django.db import models
 from .models import Profile,FriendRequest
+from . import cards, hashing, presence
+from .avatars import queue_thumbnails, store_avatar
+from django.conf import settings
 # from django.contrib.auth import get_user_model
 import logging
 
@@ -16,13 +19,15 @@ class RegistrationSerializer(serializers.ModelSerializer):
         extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
-        user = User.objects.create_user(
-            username = validated_data['username'],
-            email = validated_data['email'],
-            password = validated_data['password'],
+        # Same as create_user(), with the password hashed on the hashing pool
+        user = User(
+            username = User.normalize_username(validated_data['username']),
+            email = User.objects.normalize_email(validated_data['email']),
             first_name = validated_data['first_name'],
             last_name = validated_data['last_name']
         )
+        user.password = hashing.make_password(validated_data['password'])
+        user.save()
         return user
 
 class RegistrationSerializer_42(serializers.ModelSerializer):
@@ -44,18 +49,53 @@ class RegistrationSerializer_42(serializers.ModelSerializer):
         # user.save()
         return user
 
-class ProfileDetailSerializer(serializers.ModelSerializer):
+class CardListSerializer(serializers.ListSerializer):
+    """Loads the user cards for every row with one cache multi-get."""
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        self.context['cards'] = cards.get_cards([self.child.card_user_id(item) for item in items])
+        return super().to_representation(items)
+
+class CardMixin:
+    """
+    For serializers rendering a user's avatar/username from cards.get_cards().
+    card_user_field names the attribute holding that user's id. Users
+    without a card (deleted since) render as None.
+    """
+    card_user_field = 'id'
+
+    def card_user_id(self, obj):
+        return getattr(obj, self.card_user_field)
+
+    def get_card(self, obj):
+        user_id = self.card_user_id(obj)
+        card = (self.context.get('cards') or {}).get(user_id)
+        return card if card is not None else cards.get_card(user_id)
+
+    def card_username(self, obj):
+        card = self.get_card(obj)
+        return card['username'] if card else None
+
+    def card_avatar(self, obj, size):
+        card = self.get_card(obj)
+        return cards.card_avatar(card, size) if card else None
+
+class ProfileDetailSerializer(CardMixin, serializers.ModelSerializer):
     avatar = serializers.SerializerMethodField()
-    username = serializers.CharField(source='user.username', read_only=True)
+    username = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
         fields = ['user', 'bio', 'username','email', 'first_name', 'last_name', 'avatar', 'created_at']
+        list_serializer_class = CardListSerializer
+
+    card_user_field = 'user_id'
+
+    def get_username(self, obj):
+        return self.card_username(obj)
 
     def get_avatar(self, obj):
-        if obj.avatar:
-            return obj.avatar.url
-        return obj.avatar_url
+        return self.card_avatar(obj, settings.AVATAR_PROFILE_SIZE)
     
 class ProfileSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', required=False)
@@ -84,10 +124,17 @@ class ProfileSerializer(serializers.ModelSerializer):
             setattr(user, attr, value)
         user.save()
 
+        avatar = validated_data.pop('avatar', None)
+        if avatar:
+            store_avatar(instance, avatar)
+
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
+        if avatar:
+            queue_thumbnails(instance)
 
+        cards.invalidate_cards(user.id)
         return instance
     
 class LoginSerializer(serializers.Serializer):
@@ -95,41 +142,57 @@ class LoginSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True)
 
     def validate(self, data):
-        user = authenticate(username=data['username'], password=data['password'])
-        if not user:
+        # What authenticate() does with ModelBackend, but hashing on the
+        # bounded pool. Raises HashingOverloaded when the pool is full.
+        user = User.objects.filter(username=data['username']).first()
+        valid, needs_rehash = hashing.check_password(data['password'], user.password if user else None)
+        if not valid or not user.is_active:
             raise serializers.ValidationError("Invalid username or password")
+        if needs_rehash:
+            user.password = hashing.make_password(data['password'])
+            user.save(update_fields=['password'])
         data['user'] = user
         return data
 
-class FriendRequestSerializer(serializers.ModelSerializer):
-    sender_username = serializers.CharField(source='sender.username', read_only=True)
-    sender_id = serializers.IntegerField(source='sender.id', read_only=True)
+class FriendRequestSerializer(CardMixin, serializers.ModelSerializer):
+    sender_username = serializers.SerializerMethodField()
+    sender_id = serializers.IntegerField(read_only=True)
     sender_avatar = serializers.SerializerMethodField()
     
     class Meta:
         model = FriendRequest
         fields = ['id', 'sender_id', 'sender_username', 'sender_avatar','timestamp', 'status']
+        list_serializer_class = CardListSerializer
+
+    card_user_field = 'sender_id'
+
+    def get_sender_username(self, obj):
+        return self.card_username(obj)
+
     def get_sender_avatar(self, obj):
-        profile = obj.sender.profile
-        if profile.avatar:
-            return profile.avatar.url
-        return profile.avatar_url
+        return self.card_avatar(obj, settings.AVATAR_LIST_SIZE)
     
-class UserSerializer(serializers.ModelSerializer):
+class UserListSerializer(CardListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.Manager) else data)
+        # One bulk presence lookup for the whole list
+        self.context['presence'] = presence.get_presence([user.id for user in users])
+        return super().to_representation(users)
+
+class UserSerializer(CardMixin, serializers.ModelSerializer):
     avatar = serializers.SerializerMethodField()
-    online_status = serializers.BooleanField(source='profile.online_status', read_only=True)
+    online_status = serializers.SerializerMethodField()
     
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email', 'avatar', 'online_status']
+        list_serializer_class = UserListSerializer
     
+    def get_online_status(self, obj):
+        presence_map = self.context.get('presence') or {}
+        if obj.id in presence_map:
+            return presence_map[obj.id]
+        return presence.is_online(obj.id)
+
     def get_avatar(self, obj):
-        profile = obj.profile
-        if profile.avatar:
-            return profile.avatar.url
-        return profile.avatar_url
-    
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        logger.info(f"Serialized user {instance.username}: {data}")
-        return data
\ No newline at end of file
+        return self.card_avatar(obj, settings.AVATAR_LIST_SIZE)
\ No newline at end of file
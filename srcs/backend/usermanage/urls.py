@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import login_42, callback_42,RegistrationView, LoginView, ProfileUpdateView, SendFriendRequestView, AcceptFriendRequestView, RejectFriendRequestView, PendingFriendRequestsView,FriendListView,UserListView,ProfileDetailView
+from .views import login_42, callback_42,RegistrationView, LoginView, ProfileUpdateView, SendFriendRequestView, AcceptFriendRequestView, RejectFriendRequestView, PendingFriendRequestsView,FriendListView,UserListView,ProfileDetailView,PresenceView,UserAutocompleteView,UserBatchView
 from . import views
 urlpatterns = [
     path('42_login/', login_42.as_view(), name='login_42'),
@@ -16,4 +16,7 @@ urlpatterns = [
     # path('users/', views.user_list, name='user_list'),
     path("profile/", ProfileDetailView.as_view(), name="profile-detail"),
     path('users/', UserListView.as_view(),name='userlistview'),
+    path('users/autocomplete/', UserAutocompleteView.as_view(), name='user-autocomplete'),
+    path('users/batch/', UserBatchView.as_view(), name='user-batch'),
+    path('presence/', PresenceView.as_view(), name='presence'),
 ]
\ No newline at end of file
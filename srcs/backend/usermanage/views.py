@@ -6,21 +6,37 @@ from rest_framework import status,generics
 from django.contrib.auth.models import User
 from rest_framework.permissions import IsAuthenticated,AllowAny
 from .models import Profile,FriendRequest
+from . import cards, friends, oauth, presence
+from .friends import get_friend_ids
+from .pagination import UserCursorPagination
+from .autocomplete import autocomplete
+from .avatars import AvatarSizeLimitUploadHandler
+from .hashing import HashingOverloaded
+from django.conf import settings
+from rest_framework.filters import SearchFilter
+from rest_framework_json_api.filters import QueryParameterValidationFilter
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import RegistrationSerializer, LoginSerializer, ProfileSerializer, UserSerializer, RegistrationSerializer_42, FriendRequestSerializer, ProfileDetailSerializer
-import requests
-from django.db.models import Q
+import httpx
+import logging
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
+from django.views import View
 from rest_framework.parsers import MultiPartParser, FormParser
 # import json
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_AVATAR_URL = "https://upload.wikimedia.org/wikipedia/commons/7/7c/Profile_avatar_placeholder_large.png"
 
 class login_42(APIView):
     permission_classes = [AllowAny]
     def get(self, request):
-        return redirect("https://api.intra.42.fr/oauth/authorize?client_id=u-s4t2ud-aeae34338eb2b61bbead013fba955aaefb9923825c0ad7e439f156a270a0ba29&redirect_uri=https%3A%2F%2Flocalhost%3A8000%2Foauth%2Fcallback%2F&response_type=code")
+        config = settings.FT_OAUTH
+        query = urlencode({'client_id': config['CLIENT_ID'], 'redirect_uri': config['REDIRECT_URI'], 'response_type': 'code'})
+        return redirect(f"{config['API_URL']}/oauth/authorize?{query}")
 
 # def save_to_json(data, file_path="data.json"):
 #     try:
@@ -30,63 +46,54 @@ class login_42(APIView):
 #     except Exception as e:
 #         print(f"An error occurred while saving data to {file_path}: {e}")
 
-class callback_42(APIView):
-    permission_classes = [AllowAny]
-    def get(self, request):
+class callback_42(View):
+    """
+    Async so the two round-trips to the 42 API don't hold a worker thread;
+    only the user lookup/creation runs in the sync thread pool.
+    """
+    async def get(self, request):
         code = request.GET.get('code')
-        token_url = 'https://api.intra.42.fr/oauth/token'
-        data = {
-            'grant_type': 'authorization_code',
-            'client_id': "u-s4t2ud-aeae34338eb2b61bbead013fba955aaefb9923825c0ad7e439f156a270a0ba29",
-            'client_secret': "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",
-            'code': code,
-            'redirect_uri': "https://localhost:8000/oauth/callback/",
-        }
-        response = requests.post(token_url, data=data)
-        token_info = response.json()
-        access_token = token_info.get('access_token')
+        if not code:
+            return redirect("https://127.0.0.1:8000/?error")
+        try:
+            access_token = await oauth.exchange_code(code)
+            user_data = await oauth.fetch_me(access_token) if access_token else None
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"42 OAuth failed: {e!r}")
+            user_data = None
+        if not user_data:
+            return redirect("https://127.0.0.1:8000/?error")
+
+        user = await sync_to_async(self.get_or_create_user)(user_data)
+        if user is None:
+            return redirect("https://127.0.0.1:8000/?error")
+        refresh = RefreshToken.for_user(user)
+        access_token = str(refresh.access_token)
+        return redirect(f"https://127.0.0.1:5173/#/dashboard?success&access_token={access_token}&user_id={user.id}")
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
+    def get_or_create_user(self, user_data):
+        existing = User.objects.filter(email=user_data.get('email')).first()
+        if existing:
+            return existing
+        user_data_serialized = {
+            'username': user_data.get('login'),
+            'email': user_data.get('email'),
+            'first_name': user_data.get('first_name', ''),
+            'last_name': user_data.get('last_name', ''),
         }
-        response = requests.get('https://api.intra.42.fr/v2/me', headers=headers)
+        serializer = RegistrationSerializer_42(data=user_data_serialized)
+        if not serializer.is_valid():
+            logger.error(f"42 user rejected: {serializer.errors}")
+            return None
+        avatar_urls = (user_data.get("image") or {}).get("link") or DEFAULT_AVATAR_URL
+        user = serializer.save()
+        Profile.objects.filter(user=user).update(avatar_url=avatar_urls)
+        return user
 
-        user_data = response.json()
-        email = user_data.get('email')
-        if response.status_code != 200:
-            return redirect("https://127.0.0.1:8000/?error")
-        elif response.status_code == 200:
-            if User.objects.filter(email=email).exists():
-                exist = User.objects.get(email=email)
-                refresh = RefreshToken.for_user(exist)
-                access_token = str(refresh.access_token)
-                user_id = exist.id
-                redirect_url = f"https://127.0.0.1:5173/#/dashboard?success&access_token={access_token}&user_id={user_id}"
-                # return redirect(redirect_url)
-            else:
-                user_data = response.json()
-                user_data_serialized = {
-                'username': user_data.get('login'),
-                'email': user_data.get('email'),
-                'first_name': user_data.get('first_name', ''),
-                'last_name': user_data.get('last_name', ''),
-                }
-                serializer = RegistrationSerializer_42(data=user_data_serialized)
-                if serializer.is_valid():
-                    avatar_urls = user_data.get("image", {}).get("link") or DEFAULT_AVATAR_URL 
-                    user = serializer.save()
-                    profile = Profile.objects.get(user=user)
-                    profile.avatar_url = avatar_urls
-                    profile.save()
-                    user_id = user.id
-                    refresh = RefreshToken.for_user(user)
-                    access_token = str(refresh.access_token)
-                # else :
-                #     user = User.objects.get(username=user_data.get('login'))
-                #     refresh = RefreshToken.for_user(user)
-                #     access_token = str(refresh.access_token)
-                redirect_url = f"https://127.0.0.1:5173/#/dashboard?success&access_token={access_token}&user_id={user_id}"
-            return redirect(redirect_url)
+def overloaded_response():
+    response = Response({"error": "Too many login attempts right now, try again shortly"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(settings.PASSWORD_HASH_RETRY_AFTER)
+    return response
 
 class RegistrationView(APIView):
     permission_classes = [AllowAny]
@@ -97,8 +104,11 @@ class RegistrationView(APIView):
             email = request.data.get('email')
             if User.objects.filter(email=email).exists():
                 return Response({"error": "Email already exists"}, status=400)
-            user = serializer.save()
-            profile = Profile.objects.get(user=user)
+            try:
+                user = serializer.save()
+            except HashingOverloaded:
+                return overloaded_response()
+            profile = user.profile  # cached by the post_save receiver that created it
             return Response({
                 "message": "User registered successfully!",
                 "user": {
@@ -123,7 +133,11 @@ class LoginView(APIView):
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
-        if serializer.is_valid():
+        try:
+            valid = serializer.is_valid()
+        except HashingOverloaded:
+            return overloaded_response()
+        if valid:
             user = serializer.validated_data['user']
             refresh = RefreshToken.for_user(user)
             return Response({
@@ -141,8 +155,14 @@ class ProfileUpdateView(APIView):
 
 
     def put(self, request):
+        size_limit = AvatarSizeLimitUploadHandler()
+        request.upload_handlers.insert(0, size_limit)
+        data = request.data
+        if size_limit.exceeded:
+            return Response({"error": f"Avatar must be at most {settings.AVATAR_MAX_UPLOAD_SIZE // (1024 * 1024)} MB"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
         profile = request.user.profile
-        serializer = ProfileSerializer(profile, data=request.data, partial=True)
+        serializer = ProfileSerializer(profile, data=data, partial=True)
 
         if serializer.is_valid():
             serializer.save()
@@ -166,6 +186,9 @@ class SendFriendRequestView(APIView):
         if sender == receiver:
             return Response({"error": "You cannot send a friend request to yourself."}, status=status.HTTP_400_BAD_REQUEST)
         
+        if friends.are_friends(sender.id, receiver.id):
+            return Response({"error": "You are already friends."}, status=status.HTTP_400_BAD_REQUEST)
+
         if FriendRequest.objects.filter(sender=sender, receiver=receiver, status="pending").exists():
             return Response({"error": "Friend request already sent."}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -202,35 +225,16 @@ class FriendListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
+        friend_ids = get_friend_ids(request.user.id)
+        friend_users = User.objects.filter(id__in=friend_ids)
 
-        sent_requests = FriendRequest.objects.filter(sender=user, status="accepted")
-        received_requests = FriendRequest.objects.filter(receiver=user, status="accepted")
-        
-        friends = [fr.receiver for fr in sent_requests] + [fr.sender for fr in received_requests]
-        
-        friends = list(set(friends))
-        
-        serializer = UserSerializer(friends, many=True)
+        serializer = UserSerializer(friend_users, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     def delete(self, request, username=None):
         user = request.user
-        friend = User.objects.filter(username=username).first()
-        friend_request = FriendRequest.objects.filter(
-            status="accepted",
-            sender=user,
-            receiver=friend
-        ).first()
-        
-        if not friend_request:
-            friend_request = FriendRequest.objects.filter(
-                status="accepted",
-                sender=friend,
-                receiver=user
-            ).first()
-        
-        if friend_request:
-            friend_request.delete()
+        friend_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+
+        if friend_id is not None and friends.remove_friendship(user.id, friend_id):
             return Response({"message": "Friend removed successfully"}, status=status.HTTP_200_OK)
         else:
             return Response({"error": "Friend request not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -239,6 +243,58 @@ class UserListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+    # No OrderingFilter: the cursor needs the fixed id ordering
+    filter_backends = [QueryParameterValidationFilter, SearchFilter]
+    search_fields = ['username']
+
+def parse_user_ids(request, max_ids):
+    """Parse ?ids=1,2,3; returns (ids, error response)."""
+    try:
+        user_ids = [int(user_id) for user_id in request.GET.get('ids', '').split(',') if user_id]
+    except ValueError:
+        return None, Response({"error": "ids must be a comma-separated list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(user_ids) > max_ids:
+        return None, Response({"error": f"At most {max_ids} ids per request"}, status=status.HTTP_400_BAD_REQUEST)
+    return user_ids, None
+
+class PresenceView(APIView):
+    permission_classes = [IsAuthenticated]
+    max_ids = 1000
+
+    def get(self, request):
+        user_ids, error = parse_user_ids(request, self.max_ids)
+        if error:
+            return error
+        return Response({"presence": presence.get_presence(user_ids)}, status=status.HTTP_200_OK)
+
+class UserBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+    max_ids = 500
+
+    def get(self, request):
+        user_ids, error = parse_user_ids(request, self.max_ids)
+        if error:
+            return error
+        user_cards = cards.get_cards(user_ids)
+        online = presence.get_presence(list(user_cards))
+        return Response({
+            "users": [dict(user_cards[user_id], online_status=online[user_id]) for user_id in user_ids if user_id in user_cards],
+        }, status=status.HTTP_200_OK)
+
+class UserAutocompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    max_limit = 50
+
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return Response({"matches": []}, status=status.HTTP_200_OK)
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 10)), self.max_limit))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"matches": autocomplete(request.user.id, query, limit)}, status=status.HTTP_200_OK)
 
 class ProfileDetailView(generics.RetrieveAPIView):
     serializer_class = ProfileDetailSerializer
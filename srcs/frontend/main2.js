@@ -239,7 +239,94 @@ document.addEventListener("DOMContentLoaded", () => {
     
     let token;
     let user_id;
-    let pollingInterval = null;
+    // One realtime socket per user (ws/gateway/). Pages register a handler
+    // per stream ("presence", "chat", "invites", "matchmaking").
+    // Chat messages carry an inbox_id: they're held until a chat handler is
+    // registered, then acked so the server won't replay them on reconnect.
+    const compareInboxIds = (a, b) => {
+        const [aMs, aSeq] = a.split("-").map(Number);
+        const [bMs, bSeq] = b.split("-").map(Number);
+        return aMs - bMs || aSeq - bSeq;
+    };
+    const gateway = {
+        socket: null,
+        handlers: {},
+        queue: [],
+        presence: {},
+        chatBuffer: [],
+        seenInboxId: null,
+        ackTimer: null,
+        connect() {
+            if (this.socket && this.socket.readyState <= WebSocket.OPEN) return;
+            const token = localStorage.getItem('authToken');
+            if (!token) return;
+            this.socket = new WebSocket(`wss://127.0.0.1:8000/ws/gateway/?token=${token}`);
+            this.socket.onopen = () => {
+                while (this.queue.length > 0) this.socket.send(this.queue.shift());
+            };
+            this.socket.onmessage = (event) => {
+                const data = JSON.parse(event.data);
+                if (data.stream === "presence") {
+                    data.online.forEach(id => { this.presence[id] = true; });
+                    data.offline.forEach(id => { this.presence[id] = false; });
+                }
+                if (data.stream === "chat" && data.inbox_id) {
+                    // Replays can repeat messages that also arrived live
+                    if (this.seenInboxId && compareInboxIds(data.inbox_id, this.seenInboxId) <= 0) return;
+                    this.seenInboxId = data.inbox_id;
+                    if (this.handlers.chat) this.deliverChat(data);
+                    else this.chatBuffer.push(data);
+                    return;
+                }
+                const handler = this.handlers[data.stream];
+                if (handler) handler(data);
+            };
+            this.socket.onerror = (error) => console.error("Gateway WebSocket error:", error);
+            this.socket.onclose = (event) => {
+                this.socket = null;
+                if (event.code !== 1000 && event.code !== 4001 && localStorage.getItem('authToken')) {
+                    setTimeout(() => this.connect(), 2000);
+                }
+            };
+        },
+        on(stream, handler) {
+            this.handlers[stream] = handler;
+            if (stream === "chat") {
+                const buffered = this.chatBuffer;
+                this.chatBuffer = [];
+                buffered.forEach(data => this.deliverChat(data));
+            }
+            this.connect();
+        },
+        deliverChat(data) {
+            this.handlers.chat(data);
+            // One ack for a burst of messages
+            clearTimeout(this.ackTimer);
+            this.ackTimer = setTimeout(() => this.send("chat", "ack", { id: data.inbox_id }), 500);
+        },
+        off(stream) {
+            delete this.handlers[stream];
+        },
+        send(stream, action, payload = {}) {
+            const message = JSON.stringify({ stream, action, ...payload });
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.socket.send(message);
+            } else {
+                this.queue.push(message);
+                this.connect();
+            }
+        },
+        close() {
+            if (this.socket) this.socket.close(1000, "Signed out");
+            this.socket = null;
+            this.handlers = {};
+            this.queue = [];
+            this.presence = {};
+            this.chatBuffer = [];
+            this.seenInboxId = null;
+            clearTimeout(this.ackTimer);
+        },
+    };
     
     const hash = window.location.hash;
     console.log("Hash:", hash);
@@ -302,10 +389,7 @@ document.addEventListener("DOMContentLoaded", () => {
           localStorage.removeItem("hasRedirected"); 
           token = "";
           user_id = "";
-          if (pollingInterval) {
-            clearInterval(pollingInterval);
-            pollingInterval = null;
-          }
+          gateway.close();
           localStorage.clear();
           navigateTo('#/sign-in');
         });
@@ -377,9 +461,8 @@ document.addEventListener("DOMContentLoaded", () => {
     
         const authenticated = await isAuthenticated();
 
-        if (pollingInterval && route !== '#/dashboard') {
-            clearInterval(pollingInterval);
-            pollingInterval = null;
+        if (route !== '#/dashboard') {
+            gateway.off("presence");
         }
     
         if (protectedRoutes.includes(route)) {
@@ -1451,8 +1534,8 @@ document.addEventListener("DOMContentLoaded", () => {
                 renderFriendList(friendList, friendListContainer);
             }
     
-            // Start polling for status updates
-            startFriendStatusPolling(friendListContainer);
+            // Subscribe to status updates
+            startFriendStatusStream(friendListContainer);
         } catch (error) {
             console.error("Error fetching friend list:", error);
         }
@@ -1505,37 +1588,15 @@ document.addEventListener("DOMContentLoaded", () => {
         });
     }
     
-    function startFriendStatusPolling(container) {
-        // Stop any existing polling
-        if (pollingInterval) {
-            clearInterval(pollingInterval);
-        }
-    
-        // Poll every 30 seconds
-        pollingInterval = setInterval(async () => {
-            try {
-                const response = await fetch("https://127.0.0.1:8000/friends/list/", {
-                    method: "GET",
-                    headers: {
-                        "Content-Type": "application/json",
-                        "Authorization": `Bearer ${localStorage.getItem("authToken")}`,
-                    },
-                });
-    
-                if (!response.ok) {
-                    console.error("Polling failed. Status:", response.status);
-                    return;
-                }
-    
-                const data = await response.json();
-                if (data.data && Array.isArray(data.data)) {
-                    const friendList = data.data.map(item => Object.assign({}, item.attributes, { id: item.id }));
-                    updateFriendStatuses(friendList, container);
-                }
-            } catch (error) {
-                console.error("Error during friend status polling:", error);
-            }
-        }, 30000); // 30 seconds
+    function startFriendStatusStream(container) {
+        // The gateway sends a snapshot of every friend on connect, then
+        // online/offline deltas; apply what it already knows first
+        updateFriendStatuses(Object.entries(gateway.presence).map(([id, online]) => ({ id, online_status: online })), container);
+        gateway.on("presence", (data) => {
+            const friendList = data.online.map(id => ({ id, online_status: true }))
+                .concat(data.offline.map(id => ({ id, online_status: false })));
+            updateFriendStatuses(friendList, container);
+        });
     }
     
     function updateFriendStatuses(friendList, container) {
@@ -1546,7 +1607,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 const newStatusColor = friend.online_status ? "#28a745" : "#6c757d";
                 if (statusDot.style.backgroundColor !== newStatusColor) {
                     statusDot.style.backgroundColor = newStatusColor;
-                    console.log(`Updated status for ${friend.username} to ${friend.online_status ? 'online' : 'offline'}`);
+                    console.log(`Updated status for ${friend.username || friend.id} to ${friend.online_status ? 'online' : 'offline'}`);
                 }
             }
         });
@@ -1699,9 +1760,11 @@ document.addEventListener("DOMContentLoaded", () => {
         });
       }
 
-    async function fetchAndDisplayUsers() {
+    async function fetchAndDisplayUsers(query = "") {
         try {
-            const response = await fetch("https://127.0.0.1:8000/users/", {
+            // The directory is paginated; searching happens server-side
+            const params = query ? `?filter[search]=${encodeURIComponent(query)}` : "";
+            const response = await fetch(`https://127.0.0.1:8000/users/${params}`, {
             method: "GET",
             headers: {
               "Content-Type": "application/json",
@@ -1731,8 +1794,11 @@ document.addEventListener("DOMContentLoaded", () => {
             userList = userList.filter(user => parseInt(user.id) !== parseInt(currentUserId));
           }
       
-          // Save the full list globally
           allUsers = userList;
+          if (query) {
+            displayUserSearchResults(userList);
+            return;
+          }
           shuffleArray(userList);
 
           // Display only the first 5 users
@@ -1744,17 +1810,7 @@ document.addEventListener("DOMContentLoaded", () => {
       }
 
       async function searchAndDisplayUsers(query) {
-        // If allUsers isn't loaded yet, fetch it first
-        if (!allUsers.length) {
-          await fetchAndDisplayUsers();
-        }
-        // Filter allUsers by username (case-insensitive)
-        const filteredUsers = allUsers.filter(user =>
-          user.username.toLowerCase().includes(query.toLowerCase())
-        );
-        // Limit the results to 5
-        // const limitedFiltered = filteredUsers.slice(0, 5);
-        displayUserSearchResults(filteredUsers);
+        await fetchAndDisplayUsers(query);
       }
 
     ////////////////////////////edit profile/////////////////////////////
@@ -2055,8 +2111,6 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     
         let receiver = null;
-        let chatSocket = null;
-        let messageQueue = [];
         const conversations = JSON.parse(localStorage.getItem('conversations')) || {};
         // Store blocked users in localStorage
         let blockedUsers = JSON.parse(localStorage.getItem('blockedUsers')) || [];
@@ -2065,76 +2119,30 @@ document.addEventListener("DOMContentLoaded", () => {
         loadChatHistory();
     
         function connectWebSocket() {
-            if (!receiver || !sender) {
-                console.error("Receiver or sender not set. Cannot connect WebSocket.");
-                return;
-            }
-            const users = [sender, receiver];
-            const url = `wss://127.0.0.1:8000/ws/chat/${users[0]}/${users[1]}/`;
-            console.log("Attempting to connect to WebSocket:", url);
-    
-            if (chatSocket && chatSocket.url === url && chatSocket.readyState === WebSocket.OPEN) {
-                console.log("WebSocket already connected to this URL.");
-                return;
-            }
-    
-            if (chatSocket) {
-                chatSocket.close(1000, "New connection starting");
-                console.log("Closed previous WebSocket.");
-            }
-    
-            chatSocket = new WebSocket(url);
-    
-            chatSocket.onopen = function() {
-                console.log("WebSocket connected successfully.");
-                while (messageQueue.length > 0) {
-                    const message = messageQueue.shift();
-                    if (!blockedUsers.includes(receiver.toLowerCase())) {
-                        chatSocket.send(JSON.stringify({ "message": message }));
-                    }
+            // Every conversation arrives on the gateway's chat stream
+            gateway.on("chat", (data) => {
+                if (data.type !== "chat" || data.sender === sender) return; // our own echo
+                const partner = data.sender;
+                // Check if the sender is blocked
+                if (blockedUsers.includes(partner.toLowerCase())) {
+                    console.log(`Blocked message from ${partner} ignored.`);
+                    return; // Ignore messages from blocked users
                 }
-            };
-    
-            chatSocket.onmessage = function(e) {
-                const data = JSON.parse(e.data);
-                console.log("Received data:", data);
-                if (data.message) {
-                    const timestamp = new Date().toLocaleTimeString();
-                    const messageSender = data.sender === sender ? 'sender' : 'receiver';
-                    // Check if the sender is blocked
-                    if (blockedUsers.includes(data.sender.toLowerCase())) {
-                        console.log(`Blocked message from ${data.sender} ignored.`);
-                        return; // Ignore messages from blocked users
-                    }
-                    console.log(`Message from ${data.sender} to ${receiver}, displayed as ${messageSender}`);
-                    if (!conversations[receiver]) conversations[receiver] = [];
-                    const exists = conversations[receiver].some(msg => 
-                        msg.text === data.message && msg.time === timestamp && msg.type === messageSender
-                    );
-                    if (!exists) {
-                        conversations[receiver].push({ text: data.message, type: messageSender, time: timestamp });
-                        localStorage.setItem('conversations', JSON.stringify(conversations));
-                        displayMessage(data.message, messageSender, timestamp, data.sender);
-                    }
-                }
-            };
-    
-            chatSocket.onerror = function(error) {
-                console.error("WebSocket connection failed:", error);
-            };
-    
-            chatSocket.onclose = function(event) {
-                console.log("WebSocket closed. Code:", event.code, "Reason:", event.reason);
-                if (event.code !== 1000) {
-                    setTimeout(connectWebSocket, 2000);
+                // Replayed messages carry when they were sent
+                const timestamp = (data.timestamp ? new Date(data.timestamp) : new Date()).toLocaleTimeString();
+                if (!conversations[partner]) conversations[partner] = [];
+                conversations[partner].push({ text: data.message, type: 'receiver', time: timestamp });
+                localStorage.setItem('conversations', JSON.stringify(conversations));
+                if (partner === receiver) {
+                    displayMessage(data.message, 'receiver', timestamp, partner);
                 }
-            };
+            });
         }
     
         function sendMessage() {
             const userMessage = chatInput.value.trim();
-            if (!userMessage || !receiver || !chatSocket) {
-                console.warn("Cannot send message. Missing:", { userMessage, receiver, chatSocket });
+            if (!userMessage || !receiver) {
+                console.warn("Cannot send message. Missing:", { userMessage, receiver });
                 return;
             }
     
@@ -2154,12 +2162,8 @@ document.addEventListener("DOMContentLoaded", () => {
             chatInput.value = '';
             chatMessages.scrollTop = chatMessages.scrollHeight;
     
-            if (chatSocket.readyState === WebSocket.OPEN) {
-                chatSocket.send(JSON.stringify({ "message": userMessage }));
-            } else {
-                messageQueue.push(userMessage);
-                console.log("WebSocket not open. Message queued:", userMessage);
-            }
+            // Queued by the gateway if it is reconnecting
+            gateway.send("chat", "send", { to: receiver, message: userMessage });
         }
     
         function displayMessage(message, senderType, timestamp, senderName) {
@@ -2264,61 +2268,27 @@ document.addEventListener("DOMContentLoaded", () => {
                 }
         
                 friendListContainer.innerHTML = ""; // Clear previous content
-                let friendsSocket = null;
-
-                const initializeFriendsWebSocket = () => {
-                    const token = localStorage.getItem("authToken");
-                    if (!token) {
-                        console.error("No auth token available.");
-                        navigateTo('#/sign-in');
-                        return;
+                gateway.on("invites", (data) => {
+                    switch (data.type) {
+                        case "invite_received":
+                            if (confirm(`${data.inviter} has invited you to a Pong match. Accept?`)) {
+                                gateway.send("invites", "accept", { inviter: data.inviter });
+                            }
+                            break;
+                        case "match_found":
+                            startPrivateMatch(data);
+                            break;
+                        case "invite_sent":
+                            console.log(data.message);
+                            break;
+                        case "waiting":
+                            console.log(data.message);
+                            break;
+                        case "error":
+                            console.error(data.message);
+                            break;
                     }
-
-                    friendsSocket = new WebSocket('wss://127.0.0.1:8000/ws/friends/');
-                    friendsSocket.onopen = () => {
-                        console.log("Friends WebSocket connected");
-                        friendsSocket.send(JSON.stringify({
-                            action: "authenticate",
-                            authToken: token,
-                        }));
-                    };
-
-                    friendsSocket.onmessage = (event) => {
-                        const data = JSON.parse(event.data);
-                        switch (data.type) {
-                            case "invite_received":
-                                if (confirm(`${data.inviter} has invited you to a Pong match. Accept?`)) {
-                                    friendsSocket.send(JSON.stringify({
-                                        action: "accept_invite",
-                                        inviter: data.inviter,
-                                    }));
-                                }
-                                break;
-                            case "match_found":
-                                startPrivateMatch(data);
-                                break;
-                            case "invite_sent":
-                                console.log(data.message);
-                                break;
-                            case "waiting":
-                                console.log(data.message);
-                                break;
-                            case "error":
-                                console.error(data.message);
-                                if (data.message === "Authentication required") {
-                                    navigateTo('#/sign-in');
-                                }
-                                break;
-                        }
-                    };
-
-                    friendsSocket.onerror = (error) => console.error("Friends WebSocket error:", error);
-                    friendsSocket.onclose = (event) => {
-                        console.log("Friends WebSocket closed:", event.code, event.reason);
-                        if (event.code !== 1000) setTimeout(initializeFriendsWebSocket, 2000);
-                    };
-                };
-                initializeFriendsWebSocket();
+                });
                 function startPrivateMatch(data) {
                     // navigateTo('#/game');
                     // const app = document.getElementById('app');
@@ -2376,15 +2346,7 @@ document.addEventListener("DOMContentLoaded", () => {
                         inviteGameButton.classList.add("invite-game-btn");
                         inviteGameButton.addEventListener("click", (e) => {
                             e.stopPropagation();
-                            if (friendsSocket && friendsSocket.readyState === WebSocket.OPEN) {
-                                friendsSocket.send(JSON.stringify({
-                                    action: "invite_friend",
-                                    friend_username: friend.username,
-                                }));
-                            } else {
-                                console.error("Friends WebSocket not connected");
-                                alert("Unable to send invite. Please wait or refresh.");
-                            }
+                            gateway.send("invites", "invite", { friend_username: friend.username });
                         });
                         
                         
@@ -2618,10 +2580,6 @@ document.addEventListener("DOMContentLoaded", () => {
                     receiver = null;
                     chatHeader.textContent = "Select a friend to start chatting";
                     chatMessages.innerHTML = "";
-                    if (chatSocket) {
-                        chatSocket.close(1000, "Blocked user, closing chat");
-                        chatSocket = null;
-                    }
                 }
             } catch (error) {
                 console.error("Error toggling block status:", error);
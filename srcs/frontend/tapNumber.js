@@ -31,7 +31,7 @@ export class NumberTapGame {
             return;
         }
     
-        const wsUrl = 'wss://127.0.0.1:8000/ws/number-tap/';
+        const wsUrl = `wss://127.0.0.1:8000/ws/number-tap/?token=${access_token}`;
         console.log('Attempting WebSocket connection to:', wsUrl, 'with token:', access_token);
     
         this.webSocket = new WebSocket(wsUrl);
@@ -198,7 +198,7 @@ export class PongGame {
 
     async setupFriendsMatchWebSocket() {
         console.log("Setting up friends match WebSocket with gameGroupName:", this.gameGroupName);
-        this.socket = new WebSocket(`wss://localhost:8000/ws/game/${this.gameGroupName}/`);
+        this.socket = new WebSocket(`wss://localhost:8000/ws/game/${this.gameGroupName}/?token=${localStorage.getItem('authToken')}`);
         this.socket.onopen = () => {
             console.log(`WebSocket opened for ${this.gameGroupName}`);
             this.initObjects();
@@ -219,7 +219,7 @@ export class PongGame {
     }
 
     async setupMatchmakingWebSocket() {
-        this.socket = new WebSocket('wss://localhost:8000/ws/matchmaking/');
+        this.socket = new WebSocket(`wss://localhost:8000/ws/matchmaking/?token=${localStorage.getItem('authToken')}`);
         this.socket.onopen = () => {
             this.socket.send(JSON.stringify({
                 action: 'join_queue',
@@ -243,7 +243,7 @@ export class PongGame {
     }
 
     setupGameWebSocket() {
-        this.socket = new WebSocket(`wss://localhost:8000/ws/game/${this.gameGroupName}/`);
+        this.socket = new WebSocket(`wss://localhost:8000/ws/game/${this.gameGroupName}/?token=${localStorage.getItem('authToken')}`);
         this.socket.onopen = () => {
             this.initObjects();
             this.determinePlayerRole();
@@ -308,6 +308,10 @@ export class PongGame {
 
     handleGameMessage(event) {
         const data = JSON.parse(event.data);
+        if (data.type === 'game_update') {
+            // The server holds back newer frames until earlier ones are acked
+            this.socket.send(JSON.stringify({ action: 'ack', seq: data.seq }));
+        }
         if (data.type === 'game_update' || data.type === 'game_init') {
             this.updateGameState(data);
             if (this.isGameActive && (data.score1 >= this.maxScore || data.score2 >= this.maxScore)) {